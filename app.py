@@ -1,17 +1,21 @@
-from flask import Flask, request, render_template,jsonify
-import pandas as pd
+from flask import Flask, request, render_template,jsonify,Response,stream_with_context,g,send_file
 import numpy as np
-import matplotlib.pyplot as plt
-from matplotlib.backends.backend_svg import FigureCanvasSVG
-from metpy.units import units
-from metpy.calc import wind_components
-from metpy.plots import StationPlot, sky_cover
-from metpy.plots import StationPlot, sky_cover, current_weather, pressure_tendency as pt_symbols
-import io,os,json
+import os,json,re,time,zlib
 from flask_compress import Compress
 from flask_caching import Cache
 from threading import Thread
+from datetime import datetime, timedelta
 from main import schedule_task
+from python.timeseries import station_history
+from python.derived import CHANGE_FIELDS, change_geojson_path
+from python.animation import animation_frames, cycles_in_range
+from python.tiles import TILE_FIELDS, get_tile
+from python.contours import GRID_ALIASES, sample_points, read_data
+from python.archive import read_product
+from python.wind import wind_path
+from python.station_model import station_svg
+from python.catalog import RETENTION_DAYS, list_cycles, cycle_version
+from python.metrics import inc, observe, render_prometheus
 import sys
 import threading
 
@@ -24,47 +28,209 @@ matplotlib.use('Agg')
 
 app = Flask(__name__,template_folder="templates")
 Compress(app)
+app.config['COMPRESS_MIMETYPES'].append('application/x-ndjson')
 
 cache = Cache(app, config={'CACHE_TYPE': 'simple'})
 
+# Count hits and misses of the view cache used by @cache.cached
+_cache_get = cache.cache.get
+def _counted_cache_get(key):
+    value = _cache_get(key)
+    inc('cache_requests_total', cache='views', result='miss' if value is None else 'hit')
+    return value
+cache.cache.get = _counted_cache_get
 
-def read_data(time_stamp):
-    try:
-        data_file = f"Decoded_Data/{time_stamp}.csv"
-        data = pd.read_csv(data_file)
-        return data
-    except FileNotFoundError:
-        print("File not found.")
-    except Exception as e:
-        print("An error occurred:", str(e))
+@app.before_request
+def start_timer():
+    g.request_start = time.perf_counter()
+
+@app.after_request
+def record_latency(response):
+    if 'request_start' in g:
+        observe('http_request_duration_seconds', time.perf_counter() - g.request_start,
+                endpoint=request.endpoint or 'unknown', method=request.method, status=response.status_code)
+    return response
+
+
+# File- and list-backed responses are streamed rather than built in memory,
+# so under gevent workers (SERVING_MODE=async) a slow client only holds a
+# greenlet. GeoJSON products are sent from disk as they are, or from the
+# gzipped copy written next to them; lists are gzipped chunk by chunk.
+STREAM_CHUNK_ROWS = 500
+
+def send_json_file(path, archived=None):
+    """Send a JSON product, or with `archived` = (timestamp, product) its copy in the cold archive once the file has expired."""
+    if not os.path.exists(path):
+        data = read_product(*archived) if archived else None
+        if data is None:
+            return jsonify({"error": "File not found"}), 404
+        return Response(data, mimetype='application/json')
+    # send_file would resolve a relative path against the app's directory, not the working directory
+    path = os.path.abspath(path)
+    if 'gzip' in request.accept_encodings and os.path.exists(path + '.gz'):
+        response = send_file(path + '.gz', mimetype='application/json')
+        response.headers['Content-Encoding'] = 'gzip'
+    else:
+        response = send_file(path, mimetype='application/json')
+    # The body depends on Accept-Encoding, so shared caches must key on it
+    response.vary.add('Accept-Encoding')
+    return response
+
+def json_array(items):
+    """A JSON array in chunks of STREAM_CHUNK_ROWS items, encoded like jsonify."""
+    chunk, separator = ['['], ''
+    for item in items:
+        chunk.append(separator + json.dumps(item, separators=(',', ':'), sort_keys=True))
+        separator = ','
+        if len(chunk) >= STREAM_CHUNK_ROWS:
+            yield ''.join(chunk)
+            chunk = []
+    chunk.append(']\n')
+    yield ''.join(chunk)
+
+def stream_json(chunks):
+    if 'gzip' not in request.accept_encodings:
+        response = Response(chunks, mimetype='application/json')
+        response.vary.add('Accept-Encoding')
+        return response
+
+    def gzipped():
+        compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+        for chunk in chunks:
+            data = compressor.compress(chunk.encode())
+            if data:
+                yield data
+        yield compressor.flush()
+
+    response = Response(gzipped(), mimetype='application/json')
+    response.headers['Content-Encoding'] = 'gzip'
+    response.vary.add('Accept-Encoding')
+    return response
 
 
 @app.route("/")
 def home():    
     return render_template("index.html")
 
+@app.route('/metrics')
+def metrics():
+    return Response(render_prometheus(), mimetype='text/plain; version=0.0.4')
+
 @app.route('/api/geojson', methods=['GET'])
-@cache.cached(timeout=60, query_string=True)
 def get_geojson():
     time_stamp = request.args.get('timestamp', type=int)
-    json_path = f"contours_data/{time_stamp}.geojson"
-    
+    return send_json_file(f"contours_data/{time_stamp}.geojson", archived=(time_stamp, 'geojson'))
+
+@app.route('/api/change', methods=['GET'])
+def get_change_geojson():
+    time_stamp = request.args.get('timestamp', type=int)
+    field = request.args.get('field', 'pressure')
+    hours = request.args.get('hours', 3, type=int)
+    if field not in CHANGE_FIELDS:
+        return jsonify({"error": f"Unknown field: {field}"}), 400
+    return send_json_file(change_geojson_path(time_stamp, field, hours))
+
+def cycle_cache_key(*args, **kwargs):
+    """View cache key of a ?timestamp= request that changes when the cycle is republished."""
+    time_stamp = request.args.get('timestamp', type=int)
+    args = '&'.join(f'{k}={v}' for k, v in sorted(request.args.items(multi=True)))
+    return f'view/{request.path}?{args}#v{cycle_version(time_stamp)}'
+
+@app.route('/api/wind', methods=['GET'])
+@cache.cached(timeout=60, make_cache_key=cycle_cache_key)
+def get_wind():
+    time_stamp = request.args.get('timestamp', type=int)
+    json_path = wind_path(time_stamp)
     if not os.path.exists(json_path):
         return jsonify({"error": "File not found"}), 404
+    with open(json_path, 'r') as file:
+        return Response(file.read(), mimetype='application/json')
 
+def parse_cycle(value):
+    """datetime of a YYYYMMDDHH timestamp, or None if `value` is not one."""
+    if len(value) != 10 or not value.isdigit():
+        return None
     try:
-        with open(json_path, 'r') as file:
-            data = json.load(file)
-    except json.JSONDecodeError:
-        return jsonify({"error": "Failed to decode JSON"}), 500
-    
-    return jsonify(data)
+        return datetime.strptime(value, "%Y%m%d%H")
+    except ValueError:
+        return None
+
+@app.route('/api/animation', methods=['GET'])
+def get_animation():
+    start = request.args.get('start')
+    end = request.args.get('end')
+    if start is None or end is None:
+        return jsonify({"error": "Missing start or end timestamp"}), 400
+    start_time, end_time = parse_cycle(start), parse_cycle(end)
+    if start_time is None or end_time is None:
+        return jsonify({"error": "start and end must be YYYYMMDDHH timestamps"}), 400
+    if end_time < start_time:
+        return jsonify({"error": "end is before start"}), 400
+    # Older cycles are archived, and every frame of a range is built on request
+    if end_time - start_time > timedelta(days=RETENTION_DAYS):
+        return jsonify({"error": f"An animation spans at most {RETENTION_DAYS} days"}), 400
+    timestamps = cycles_in_range(start, end, list_cycles())
+    return Response(stream_with_context(animation_frames(timestamps)), mimetype='application/x-ndjson')
+
+@app.route('/tiles/<field>/<int:time_stamp>/<int:z>/<int:x>/<int:y>.<any(png, webp):fmt>')
+def get_field_tile(field, time_stamp, z, x, y, fmt):
+    if field not in TILE_FIELDS:
+        return jsonify({"error": f"Unknown field: {field}"}), 404
+    data = get_tile(field, time_stamp, z, x, y, fmt)
+    if data is None:
+        return jsonify({"error": "Grid not found"}), 404
+    response = Response(data, mimetype=f'image/{fmt}')
+    response.headers['Cache-Control'] = 'public, max-age=3600'
+    return response
+
+def is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+@app.route('/api/point', methods=['GET', 'POST'])
+def get_point_values():
+    """Analysed value at lat/lon points: GET ?lat=&lon= for one point, POST {"points": [[lat, lon], ...]} for many."""
+    if request.method == 'POST':
+        body = request.get_json(silent=True)
+        if not isinstance(body, dict):
+            return jsonify({"error": "Expected a JSON object"}), 400
+        time_stamp = body.get('timestamp')
+        if isinstance(time_stamp, str) and time_stamp.isdigit():
+            time_stamp = int(time_stamp)
+        field = body.get('field', 'pressure')
+        points = body.get('points')
+        if not isinstance(points, list) or not points or not all(
+                isinstance(point, list) and len(point) == 2 and all(is_number(value) for value in point)
+                for point in points):
+            return jsonify({"error": "points must be a non-empty list of [lat, lon] pairs"}), 400
+        points = np.asarray(points, dtype=float)
+        lats, lons = points[:, 0], points[:, 1]
+    else:
+        time_stamp = request.args.get('timestamp', type=int)
+        field = request.args.get('field', 'pressure')
+        lats = [request.args.get('lat', type=float)]
+        lons = [request.args.get('lon', type=float)]
+        if lats[0] is None or lons[0] is None:
+            return jsonify({"error": "Missing lat or lon"}), 400
+    if not isinstance(time_stamp, int) or isinstance(time_stamp, bool):
+        return jsonify({"error": "timestamp must be an integer"}), 400
+
+    grid_name = GRID_ALIASES.get(field, field)
+    if not re.fullmatch(r'[A-Za-z0-9_]+', str(grid_name)):
+        return jsonify({"error": f"Unknown field: {field}"}), 400
+    values = sample_points(time_stamp, grid_name, lats, lons)
+    if values is None:
+        return jsonify({"error": "Grid not found"}), 404
+
+    values = [None if np.isnan(v) else round(float(v), 2) for v in values]
+    return jsonify({'timestamp': str(time_stamp), 'field': field, 'values': values})
 
 @app.route('/api/temperature',methods=["GET"])
 def get_temperature_data():
     time_stamp = request.args.get('timestamp', type=int)
 
     data=read_data(time_stamp)
+    if data is None:
+        return jsonify({"error": "File not found"}), 404
     data = data.dropna(subset=['air_temp'])
     data = data.drop_duplicates(subset='station_id')
     lats = data['Latitude'].tolist()
@@ -72,110 +238,37 @@ def get_temperature_data():
     air_temp = data['air_temp'].tolist()
     stations = data['Station_Name'].tolist()
     codes=data["station_id"].tolist()
-    
-    response_data = [{'lat': lat, 'lon': lon, 'temp': temp,'station':station,"code":code} for lat, lon, temp,station,code in zip(lats, lons, air_temp,stations,codes)]
-    
-    return jsonify(response_data)
+
+    rows = ({'lat': lat, 'lon': lon, 'temp': temp,'station':station,"code":code} for lat, lon, temp,station,code in zip(lats, lons, air_temp,stations,codes))
+    return stream_json(json_array(rows))
 
 @app.route('/list_data_files')
 def list_html_files():
-    geojson_dir = "contours_data"
-    geojson_files = [f for f in os.listdir(geojson_dir) if f.endswith('.geojson')]
-    return jsonify(geojson_files)
+    # The complete cycles in the catalog, named like their GeoJSON files as the frontend expects
+    geojson_files = [f"{time_stamp}.geojson" for time_stamp in list_cycles()]
+    return stream_json(json_array(geojson_files))
+
+@app.route('/api/station_history', methods=['GET'])
+def get_station_history():
+    station_id = request.args.get('code', type=int)
+    if station_id is None:
+        return jsonify({"error": "Missing station code"}), 400
+    fields = request.args.get('fields')
+    fields = fields.split(',') if fields else None
+    start = request.args.get('start')
+    end = request.args.get('end')
+    for name, value in (('start', start), ('end', end)):
+        if value is not None and parse_cycle(value) is None:
+            return jsonify({"error": f"{name} must be a YYYYMMDDHH timestamp"}), 400
+    if start is not None and end is not None and end < start:
+        return jsonify({"error": "end is before start"}), 400
+    return jsonify(station_history(station_id, fields=fields, start=start, end=end))
 
 @app.route('/generate_svg', methods=['GET'])
 def generate_svg():
     station_id = request.args.get('code', type=int)
     time_stamp = request.args.get('timestamp', type=int)
-    data=read_data(time_stamp)
-
-    data = data.drop_duplicates(subset='station_id')
-
-    station_data = data[data['station_id'] == station_id]
-
-    if station_data.empty:
-        raise ValueError(f"No station found with station_id: {station_id}. Please check the data.")
-
-    closest_station = station_data.iloc[0]
-    
-    air_temp = float(closest_station['air_temp']) if not np.isnan(closest_station['air_temp']) else None
-    dew_point = float(closest_station['dew_point']) if not np.isnan(closest_station['dew_point']) else None
-    pressure = float(closest_station['pressure_sea_level']) if not np.isnan(closest_station['pressure_sea_level']) else None
-    pressure_station = float(closest_station['pressure_station_level']) if not np.isnan(closest_station['pressure_station_level']) else None
-    wind_speed_knots = float(closest_station['wind_speed']) if not np.isnan(closest_station['wind_speed']) else None
-    wind_dir = float(closest_station['wind_direction']) if not np.isnan(closest_station['wind_direction']) else None
-    cloud_cover_value = int(round(closest_station['cloud_cover'])) if not np.isnan(closest_station['cloud_cover']) else None
-    lat = closest_station['Latitude']
-    lon = closest_station['Longitude']
-    weather_code = int(closest_station['present_weather']) if not np.isnan(closest_station['present_weather']) else None
-    pressure_tendency = int(closest_station['tendency']) if not np.isnan(closest_station['tendency']) else None
-    pressure_change = float(closest_station['pressure_change']) if not np.isnan(closest_station['pressure_change']) else None
-    Place = closest_station['Place_Name']
-
-    # Create a station plot
-    fig = plt.figure(figsize=(2, 2), dpi=300)
-    ax = fig.add_subplot(1, 1, 1)
-    # ax.axis('off')
-    
-    station_plot = StationPlot(ax, lon, lat, fontsize=15, spacing=25)
-
-    # Plot temperature if available
-    if air_temp is not None:
-        station_plot.plot_parameter('NW', [air_temp], color='red')
-    station_plot.plot_parameter('SW', [dew_point], color='red')
-    # Plot pressure if available
-    if pressure is not None:
-        station_plot.plot_parameter('NE', [pressure], color='black')
-    if weather_code is not None:
-        station_plot.plot_symbol('W', [weather_code], current_weather, fontsize=12)
-    # Plot wind barb if wind data is available
-    if wind_speed_knots is not None and wind_dir is not None:
-        u, v = wind_components(wind_speed_knots * units('knots'), wind_dir * units('degrees'))
-        station_plot.plot_barb(u=[u.magnitude], v=[v.magnitude])
-    
-    # Plot cloud cover if available
-    if cloud_cover_value is not None:
-        station_plot.plot_symbol('C', [cloud_cover_value], sky_cover)
-
-    # Plot pressure tendency if available
-    if pressure_tendency is not None:
-        station_plot.plot_symbol((1.8, 0.1), [pressure_tendency], pt_symbols)
-    # Plot pressure change if available
-    if pressure_change is not None:
-        station_plot.plot_parameter((1, 0.1), [pressure_change], color='green')
-    
-    # Convert plot to SVG
-    svg_buffer = io.StringIO()
-    canvas = FigureCanvasSVG(fig)
-    canvas.draw()
-    canvas.print_svg(svg_buffer)
-    plt.close(fig)
-    
-    # Return SVG data
-    svg_data = svg_buffer.getvalue()
-    svg_buffer.close()
-    
-    response_data = {
-        'station_id': station_id,
-        'timestamp': time_stamp,
-        'svg': svg_data,
-        'additional_data': {
-            'air_temp': air_temp,
-            'dew_point': dew_point,
-            'pressure': pressure_station,
-            'wind_speed_knots': wind_speed_knots,
-            'wind_dir': wind_dir,
-            'cloud_cover_value': cloud_cover_value,
-            'lat': round(lat, 3) ,
-            'lon': round(lon, 3) ,
-            'weather_code': weather_code,
-            'pressure_tendency': pressure_tendency,
-            'pressure_change': pressure_change,
-            'place_name':Place
-        }
-    }
-    
-    return jsonify(response_data)
+    return jsonify(station_svg(station_id, time_stamp))
 
 
 if __name__ == '__main__':
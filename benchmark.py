@@ -0,0 +1,347 @@
+"""Offline benchmark of the decode -> grid -> contour -> serve pipeline.
+
+Runs every stage on the checked-in fixtures inside a scratch copy of the
+data directories, each stage in its own forked process, and records wall
+time, peak RSS and output size to a JSON file.
+
+    python benchmark.py                                  # write bench_results.json
+    python benchmark.py --save-baseline bench_baseline.json
+    python benchmark.py --compare bench_baseline.json    # exit 1 on regressions
+"""
+import argparse,contextlib,json,logging,os,platform,resource,shutil,statistics,sys,tempfile,time
+import multiprocessing as mp
+from datetime import datetime, timedelta, timezone
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_CYCLE = "2024121900"
+STATION_CODES_FILE = "static/WMO_stations_data.csv"
+# Every fixture bulletin concatenated into one, to compare decoding modes' peak RSS
+CONCAT_SYNOP_DIR = "Synop_concat"
+
+# name -> function(ctx) returning the stage's output size in bytes (or None)
+STAGES = {}
+
+
+def stage(name):
+    def register(fn):
+        STAGES[name] = fn
+        return fn
+    return register
+
+def current_rss_mb():
+    with open('/proc/self/status') as f:
+        for line in f:
+            if line.startswith('VmRSS:'):
+                return int(line.split()[1]) / 1024
+    return 0.0
+
+def make_workspace():
+    """Scratch directory with the fixtures, so stages never write into the repo's data directories."""
+    workspace = tempfile.mkdtemp(prefix='weather-bench-')
+    os.symlink(os.path.join(REPO_DIR, 'Synop'), os.path.join(workspace, 'Synop'))
+    os.symlink(os.path.join(REPO_DIR, 'static'), os.path.join(workspace, 'static'))
+    shutil.copytree(os.path.join(REPO_DIR, 'Decoded_Data'), os.path.join(workspace, 'Decoded_Data'))
+    os.makedirs(os.path.join(workspace, 'contours_data'))
+    for filename in os.listdir(os.path.join(REPO_DIR, 'contours_data')):
+        shutil.copy(os.path.join(REPO_DIR, 'contours_data', filename), os.path.join(workspace, 'contours_data'))
+    return workspace
+
+def prepare(cycle):
+    """Load the modules and compute every stage's inputs once in the parent process."""
+    # Benchmark runs must not add to the service's metrics; forked stages inherit this
+    from python import metrics
+    metrics.disable()
+    import numpy as np
+    import scipy as sp
+    import matplotlib.pyplot as plt
+    import app as flask_app
+    from python import contours
+    # python.decoding points stdout/stderr at /dev/null on import; keep our own output
+    # but not pymetdecoder's per-group warnings
+    sys.stdout = sys.__stdout__
+    sys.stderr = sys.__stderr__
+    logging.getLogger().setLevel(logging.ERROR)
+
+    data = contours.read_data(cycle).drop_duplicates(subset='station_id')
+    pressure = data['pressure_sea_level'].values
+    valid = ~np.isnan(pressure)
+    lats, lons, values = data['Latitude'].values[valid], data['Longitude'].values[valid], pressure[valid].astype(float)
+    lat_arr = np.linspace(lats.min(), lats.max(), contours.GRID_SIZE)
+    lon_arr = np.linspace(lons.min(), lons.max(), contours.GRID_SIZE)
+    lat_grid, lon_grid = np.meshgrid(lat_arr, lon_arr)
+
+    raw_grid = contours.idw_interpolation(lons, lats, values, lon_grid.flatten(), lat_grid.flatten()).reshape(lat_grid.shape)
+    grid = sp.ndimage.gaussian_filter(raw_grid, sigma=5)
+    levels = contours.contour_levels(grid, 2)
+    contour_set = plt.contour(lon_grid, lat_grid, grid, levels=levels)
+    contours.save_grid(cycle, 'pressure_sea_level', lon_arr, lat_arr, grid)
+    from python.wind import generate_wind
+    from python.catalog import build_catalog
+    generate_wind(cycle)
+    build_catalog()
+    # The same cycle a month earlier, only in the cold archive
+    from python.archive import archive_path, append_products
+    archived_cycle = (datetime.strptime(cycle, "%Y%m%d%H") - timedelta(days=30)).strftime("%Y%m%d%H")
+    items = []
+    for product, path in (('csv', f"Decoded_Data/{cycle}.csv"), ('geojson', f"contours_data/{cycle}.geojson")):
+        with open(path, 'rb') as f:
+            items.append((archived_cycle, product, f.read()))
+    append_products(archive_path(archived_cycle), items)
+    os.makedirs(CONCAT_SYNOP_DIR)
+    with open(os.path.join(CONCAT_SYNOP_DIR, f"{cycle}syn.txt"), 'w') as out:
+        for filename in sorted(os.listdir('Synop')):
+            with open(os.path.join('Synop', filename)) as f:
+                shutil.copyfileobj(f, out)
+
+    station = int(data['station_id'].iloc[0])
+    return {
+        'cycle': cycle,
+        'np': np, 'sp': sp, 'plt': plt, 'contours': contours,
+        'client': flask_app.app.test_client(),
+        'lats': lats, 'lons': lons, 'values': values,
+        'lon_arr': lon_arr, 'lat_arr': lat_arr,
+        'lon_grid': lon_grid, 'lat_grid': lat_grid,
+        'raw_grid': raw_grid, 'grid': grid, 'levels': levels,
+        'contour_set': contour_set, 'station': station,
+        'archived_cycle': archived_cycle,
+    }
+
+@stage('process_synop_files')
+def bench_decode(ctx):
+    from python.decoding import process_synop_files
+    shutil.rmtree('Timeseries', ignore_errors=True)
+    process_synop_files(STATION_CODES_FILE, 'Synop', 'Decoded_Data', ctx['cycle'])
+    return os.path.getsize(f"Decoded_Data/{ctx['cycle']}.csv")
+
+def decode_stage(name, mode, directory):
+    def run(ctx):
+        from python.decoding import process_synop_files
+        shutil.rmtree('Timeseries', ignore_errors=True)
+        output_directory = f"Decoded_{mode}"
+        process_synop_files(STATION_CODES_FILE, directory, output_directory, ctx['cycle'], mode=mode)
+        return os.path.getsize(f"{output_directory}/{ctx['cycle']}.csv")
+    STAGES[name] = run
+
+decode_stage('process_synop_files[stream]', 'stream', 'Synop')
+decode_stage('process_synop_files[batch,concat]', 'batch', CONCAT_SYNOP_DIR)
+decode_stage('process_synop_files[stream,concat]', 'stream', CONCAT_SYNOP_DIR)
+
+@stage('fast_synop.decode_lines')
+def bench_fast_synop(ctx):
+    from python.fast_synop import decode_lines
+    with open(f"Synop/{ctx['cycle']}syn.txt", 'r') as f:
+        lines = [line.strip() for line in f if line.strip()]
+    columns, _ = decode_lines(lines, ctx['cycle'][6:10] + '4')
+    return sum(1 for value in columns['station_id'] if value is not None)
+
+@stage('idw_interpolation')
+def bench_idw(ctx):
+    zi = ctx['contours'].idw_interpolation(ctx['lons'], ctx['lats'], ctx['values'],
+                                           ctx['lon_grid'].flatten(), ctx['lat_grid'].flatten())
+    return zi.nbytes
+
+@stage('gaussian_filter')
+def bench_gaussian(ctx):
+    return ctx['sp'].ndimage.gaussian_filter(ctx['raw_grid'], sigma=5).nbytes
+
+@stage('contour')
+def bench_contour(ctx):
+    contour_set = ctx['plt'].contour(ctx['lon_grid'], ctx['lat_grid'], ctx['grid'], levels=ctx['levels'])
+    size = sum(seg.nbytes for segs in contour_set.allsegs for seg in segs)
+    ctx['plt'].close('all')
+    return size
+
+@stage('contours_to_geojson+json.dump')
+def bench_serialise(ctx):
+    geojson = ctx['contours'].contours_to_geojson(ctx['contour_set'])
+    with open('bench_contours.geojson', 'w') as f:
+        json.dump(geojson, f)
+    return os.path.getsize('bench_contours.geojson')
+
+@stage('generate_wind')
+def bench_wind(ctx):
+    from python.wind import generate_wind
+    return os.path.getsize(generate_wind(ctx['cycle']))
+
+@stage('publish_cycle')
+def bench_publish(ctx):
+    from python.catalog import publish_cycle, cycle_products
+    publish_cycle(ctx['cycle'])
+    return sum(os.path.getsize(path) for path in cycle_products(ctx['cycle']).values())
+
+@stage('archive.read_product[geojson]')
+def bench_archive_read(ctx):
+    from python.archive import read_product
+    return len(read_product(ctx['archived_cycle'], 'geojson'))
+
+def grid_stage(mask, analysis='full'):
+    name = f'mask={mask}' if analysis == 'full' else f'{analysis},mask={mask}'
+    def grid(ctx):
+        lon_arr, lat_arr, grid = ctx['contours'].analysis_grid(ctx['lons'], ctx['lats'], ctx['values'],
+                                                               mask=mask, mode=analysis)
+        return grid.nbytes
+    def geojson(ctx):
+        ctx['contours'].GRID_MASK = mask
+        ctx['contours'].GRID_ANALYSIS = analysis
+        ctx['contours'].generate_geojson(ctx['cycle'])
+        return os.path.getsize(f"contours_data/{ctx['cycle']}.geojson")
+    STAGES[f'analysis_grid[{name}]'] = grid
+    STAGES[f'generate_geojson[{name}]'] = geojson
+
+for analysis in ('full', 'coarse'):
+    for mask in ('none', 'distance', 'hull'):
+        grid_stage(mask, analysis)
+
+@stage('generate_geojson[tiled]')
+def bench_tiled_geojson(ctx):
+    ctx['contours'].GRID_DOMAIN = 'tiled'
+    ctx['contours'].generate_geojson(ctx['cycle'])
+    return os.path.getsize(f"contours_data/{ctx['cycle']}.geojson")
+
+def endpoint_stage(name, url):
+    def run(ctx):
+        response = ctx['client'].get(url.format(**ctx))
+        if response.status_code != 200:
+            raise RuntimeError(f"{url} returned {response.status_code}")
+        return len(response.get_data())
+    STAGES[name] = run
+
+endpoint_stage('GET /list_data_files', '/list_data_files')
+endpoint_stage('GET /api/geojson', '/api/geojson?timestamp={cycle}')
+endpoint_stage('GET /api/temperature', '/api/temperature?timestamp={cycle}')
+endpoint_stage('GET /api/geojson[archived]', '/api/geojson?timestamp={archived_cycle}')
+endpoint_stage('GET /api/temperature[archived]', '/api/temperature?timestamp={archived_cycle}')
+endpoint_stage('GET /generate_svg', '/generate_svg?code={station}&timestamp={cycle}')
+endpoint_stage('GET /api/point', '/api/point?timestamp={cycle}&lat=30&lon=70')
+endpoint_stage('GET /api/wind', '/api/wind?timestamp={cycle}')
+endpoint_stage('GET /tiles', '/tiles/pressure/{cycle}/5/22/12.png')
+
+def _run_child(conn, fn, ctx, repeat):
+    # Each stage gets its own copy of the workspace, so files one stage
+    # rewrites (the cycle's GeoJSON, say) are never another stage's input
+    workspace = os.getcwd()
+    stage_dir = tempfile.mkdtemp(prefix='weather-stage-')
+    try:
+        shutil.copytree(workspace, stage_dir, symlinks=True, dirs_exist_ok=True)
+        os.chdir(stage_dir)
+        start_rss = current_rss_mb()
+        times = []
+        size = None
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            for _ in range(repeat):
+                start = time.perf_counter()
+                size = fn(ctx)
+                times.append(time.perf_counter() - start)
+        peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+        conn.send({'times': times, 'output_bytes': size, 'peak_rss_mb': peak_rss,
+                   'rss_delta_mb': peak_rss - start_rss})
+    except Exception as e:
+        conn.send({'error': repr(e)})
+    finally:
+        conn.close()
+        os.chdir(workspace)
+        shutil.rmtree(stage_dir, ignore_errors=True)
+
+def run_stage(fn, ctx, repeat):
+    """Run one stage in a forked child so its peak RSS is not polluted by earlier stages."""
+    fork = mp.get_context('fork')
+    parent_conn, child_conn = fork.Pipe(duplex=False)
+    process = fork.Process(target=_run_child, args=(child_conn, fn, ctx, repeat))
+    process.start()
+    child_conn.close()
+    result = parent_conn.recv()
+    process.join()
+    if 'error' in result:
+        return result
+    times = result.pop('times')
+    result['wall_s'] = statistics.median(times)
+    result['wall_min_s'] = min(times)
+    result['repeat'] = repeat
+    return result
+
+def run_benchmarks(cycle, repeat, selected=None):
+    workspace = make_workspace()
+    previous_dir = os.getcwd()
+    os.chdir(workspace)
+    try:
+        ctx = prepare(cycle)
+        stages = {}
+        for name, fn in STAGES.items():
+            if selected and not any(s in name for s in selected):
+                continue
+            stages[name] = run_stage(fn, ctx, repeat)
+            print(format_row(name, stages[name]))
+    finally:
+        os.chdir(previous_dir)
+        shutil.rmtree(workspace, ignore_errors=True)
+    return {
+        'created': datetime.now(timezone.utc).isoformat(),
+        'cycle': cycle,
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'cpus': os.cpu_count(),
+        'stages': stages,
+    }
+
+def format_row(name, result):
+    if 'error' in result:
+        return f"{name:40s} ERROR {result['error']}"
+    size = result['output_bytes']
+    size = '-' if size is None else f"{size / 1024:.1f} KiB"
+    return f"{name:40s} {result['wall_s'] * 1000:10.1f} ms  peak {result['peak_rss_mb']:8.1f} MiB  " \
+           f"(+{result['rss_delta_mb']:.1f})  out {size}"
+
+def compare(results, baseline, threshold, min_delta_ms=5.0):
+    """Return the regressions of results against baseline as printable strings.
+
+    Wall time uses the fastest repeat and ignores changes under min_delta_ms,
+    which are timer noise for the small endpoints."""
+    regressions = []
+    for name, current in results['stages'].items():
+        previous = baseline.get('stages', {}).get(name)
+        if previous is None or 'error' in previous:
+            continue
+        if 'error' in current:
+            regressions.append(f"{name}: failed ({current['error']})")
+            continue
+        for key, label in (('wall_min_s', 'wall time'), ('peak_rss_mb', 'peak RSS'), ('output_bytes', 'output size')):
+            old, new = previous.get(key), current.get(key)
+            if not old or new is None:
+                continue
+            if key == 'wall_min_s' and (new - old) * 1000 < min_delta_ms:
+                continue
+            change = (new - old) / old
+            if change > threshold:
+                regressions.append(f"{name}: {label} {old:.4g} -> {new:.4g} (+{change:.0%})")
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--cycle', default=DEFAULT_CYCLE)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--stages', nargs='*', help='only run stages whose name contains one of these')
+    parser.add_argument('--output', default='bench_results.json')
+    parser.add_argument('--save-baseline', metavar='PATH')
+    parser.add_argument('--compare', metavar='BASELINE')
+    parser.add_argument('--threshold', type=float, default=0.25, help='allowed relative increase (default 0.25)')
+    parser.add_argument('--min-delta-ms', type=float, default=5.0, help='ignore wall time changes smaller than this')
+    args = parser.parse_args()
+
+    results = run_benchmarks(args.cycle, args.repeat, args.stages)
+    for path in filter(None, [args.output, args.save_baseline]):
+        with open(path, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"Results saved to {path}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(results, json.load(f), args.threshold, args.min_delta_ms)
+        if regressions:
+            print("Regressions against", args.compare)
+            for line in regressions:
+                print("  " + line)
+            sys.exit(1)
+        print("No regressions against", args.compare)
+
+if __name__ == '__main__':
+    main()
@@ -1,5 +1,6 @@
 import os
 import requests
+from python.metrics import inc, timer
 
 def download_file(timestamp):
 
@@ -15,13 +16,16 @@ def download_file(timestamp):
         "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/85.0.4183.121 Safari/537.36"
     }
 
-    response = requests.get(url, headers=headers)
+    with timer('pipeline_stage_seconds', stage='download'):
+        response = requests.get(url, headers=headers)
     if response.status_code == 200:
         with open(filename, 'wb') as file:
             file.write(response.content)
+        inc('downloads_total', result='ok')
         print(f"File saved as {filename}")
         return True
     else:
+        inc('downloads_total', result='failed')
         print(f"Failed to download the file. Status code: {response.status_code}")
         return False
 # a=["00","03","06","09","12","15","18","21"]
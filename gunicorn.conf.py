@@ -0,0 +1,17 @@
+import os
+
+# SERVING_MODE picks how `gunicorn app:app` serves requests:
+#   sync  - one request at a time per worker process (the default)
+#   async - gevent workers, each holding up to WORKER_CONNECTIONS connections;
+#           /generate_svg renders in a pool of SVG_RENDER_PROCESSES processes
+#           per worker (python/station_model.py)
+# The worker count comes from WEB_CONCURRENCY as usual.
+SERVING_MODE = os.environ.get('SERVING_MODE', 'sync')
+
+if SERVING_MODE == 'async':
+    worker_class = 'gevent'
+    worker_connections = int(os.environ.get('WORKER_CONNECTIONS', 1000))
+elif SERVING_MODE == 'sync':
+    worker_class = 'sync'
+else:
+    raise ValueError(f"Unknown SERVING_MODE: {SERVING_MODE}")
@@ -0,0 +1,314 @@
+"""Load test of the app under gunicorn with the frontend's request mix.
+
+Starts `gunicorn app:app` on the checked-in fixtures (in a scratch copy of
+the data directories, like benchmark.py) and runs virtual users that
+behave like static/script.js: /list_data_files on page load, then for each
+timestamp change /api/geojson, /api/temperature and /api/wind followed by
+a burst of /generate_svg clicks on stations. Reports throughput, latency
+percentiles per endpoint, and the peak RSS and CPU of every gunicorn worker
+and render process read from /proc. Everything runs offline.
+
+    python loadtest.py                                    # 2 workers, 4 users, 30 s
+    python loadtest.py --workers 1 2 4 --concurrency 4 16 --duration 60
+    python loadtest.py --mode sync async --workers 1 --concurrency 4 64
+"""
+import argparse,gzip,http.client,json,math,os,random,shutil,signal,socket,subprocess,sys,threading,time
+from collections import defaultdict
+from benchmark import REPO_DIR, make_workspace
+
+TIMESTAMP_CHANGES = 3
+CLICKS = 5
+SAMPLE_INTERVAL = 0.5
+CLK_TCK = os.sysconf('SC_CLK_TCK')
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+def prepare_workspace():
+    """Scratch data directories plus what the pipeline writes that is not checked in:
+    wind, the gzipped copies of the GeoJSON files and the cycle catalog."""
+    workspace = make_workspace()
+    cwd = os.getcwd()
+    os.chdir(workspace)
+    try:
+        sys.path.insert(0, REPO_DIR)
+        from python import metrics
+        metrics.disable()
+        from python.wind import generate_wind
+        from python.catalog import build_catalog
+        # python.decoding (imported via python.contours) points stdout/stderr at /dev/null
+        sys.stdout, sys.stderr = sys.__stdout__, sys.__stderr__
+        for name in sorted(os.listdir('contours_data')):
+            if len(name) == len('0000000000.geojson') and name[:10].isdigit():
+                generate_wind(name[:10])
+                path = os.path.join('contours_data', name)
+                with open(path, 'rb') as f, open(path + '.gz', 'wb') as out:
+                    out.write(gzip.compress(f.read(), compresslevel=6, mtime=0))
+        build_catalog()
+    finally:
+        os.chdir(cwd)
+    return workspace
+
+def start_server(workspace, port, workers, mode):
+    """gunicorn with the repo's gunicorn.conf.py, which picks the worker class from SERVING_MODE."""
+    command = [sys.executable, '-m', 'gunicorn', '--config', os.path.join(REPO_DIR, 'gunicorn.conf.py'),
+               '--chdir', workspace, '--pythonpath', REPO_DIR, '--bind', f'127.0.0.1:{port}',
+               '--workers', str(workers), '--timeout', '120', '--log-level', 'warning', 'app:app']
+    log = open(os.path.join(workspace, 'gunicorn.log'), 'a')
+    # The server under test keeps its metrics in the workspace, away from the service's
+    env = dict(os.environ, SERVING_MODE=mode, METRICS_DIR=os.path.join(workspace, 'metrics_data'))
+    return subprocess.Popen(command, cwd=workspace, stdout=log, stderr=log, env=env)
+
+def wait_ready(server, port, workers, timeout=120):
+    """Wait until every worker has imported the app and answers."""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if server.poll() is not None:
+            raise RuntimeError(f"gunicorn exited with {server.returncode}")
+        try:
+            connection = http.client.HTTPConnection('127.0.0.1', port, timeout=60)
+            connection.request('GET', '/list_data_files')
+            if connection.getresponse().status == 200 and len(worker_pids(server.pid)) >= workers:
+                return
+        except (OSError, http.client.HTTPException):
+            pass
+        time.sleep(0.5)
+    raise RuntimeError("gunicorn did not become ready")
+
+def stop_server(server):
+    server.send_signal(signal.SIGTERM)
+    try:
+        server.wait(timeout=30)
+    except subprocess.TimeoutExpired:
+        server.kill()
+        server.wait()
+
+def read_stat(pid):
+    """(ppid, cpu seconds) of a process from /proc/<pid>/stat."""
+    with open(f'/proc/{pid}/stat') as f:
+        fields = f.read().rsplit(')', 1)[1].split()
+    return int(fields[1]), (int(fields[11]) + int(fields[12])) / CLK_TCK
+
+def read_rss_mb(pid):
+    with open(f'/proc/{pid}/status') as f:
+        for line in f:
+            if line.startswith('VmRSS:'):
+                return int(line.split()[1]) / 1024
+    return 0.0
+
+def parent_pids():
+    parents = {}
+    for name in os.listdir('/proc'):
+        if name.isdigit():
+            try:
+                parents[int(name)] = read_stat(int(name))[0]
+            except (OSError, ValueError, IndexError):
+                continue
+    return parents
+
+def worker_pids(master):
+    return [pid for pid, parent in parent_pids().items() if parent == master]
+
+def descendant_pids(master):
+    """The workers and the processes they started, such as the SVG render pools of async mode."""
+    parents = parent_pids()
+    found, pids = {master}, []
+    while True:
+        new = [pid for pid, parent in parents.items() if parent in found and pid not in found]
+        if not new:
+            return pids
+        found.update(new)
+        pids.extend(new)
+
+class WorkerSampler(threading.Thread):
+    """Samples RSS and CPU time of the master's workers and their children until stopped."""
+
+    def __init__(self, master):
+        super().__init__(daemon=True)
+        self.master = master
+        self.stop = threading.Event()
+        self.workers = {}  # pid -> {'first_cpu', 'cpu', 'peak_rss', 'rss'}
+
+    def sample(self):
+        for pid in descendant_pids(self.master):
+            try:
+                cpu, rss = read_stat(pid)[1], read_rss_mb(pid)
+            except (OSError, ValueError, IndexError):
+                continue
+            worker = self.workers.setdefault(pid, {'first_cpu': cpu, 'peak_rss': 0.0})
+            worker['cpu'] = cpu
+            worker['rss'] = rss
+            worker['peak_rss'] = max(worker['peak_rss'], rss)
+
+    def run(self):
+        while not self.stop.wait(SAMPLE_INTERVAL):
+            self.sample()
+
+    def finish(self, duration):
+        self.stop.set()
+        self.join()
+        self.sample()
+        return {str(pid): {'peak_rss_mb': round(w['peak_rss'], 1), 'rss_mb': round(w['rss'], 1),
+                           'cpu_seconds': round(w['cpu'] - w['first_cpu'], 2),
+                           'cpu_percent': round((w['cpu'] - w['first_cpu']) / duration * 100, 1)}
+                for pid, w in self.workers.items()}
+
+class VirtualUser(threading.Thread):
+    """One browser tab: load the page, change the timestamp a few times, click on stations."""
+
+    def __init__(self, port, deadline, seed, results):
+        super().__init__(daemon=True)
+        self.port = port
+        self.deadline = deadline
+        self.rng = random.Random(seed)
+        self.results = results
+        self.connection = None
+
+    def get(self, endpoint, path):
+        if time.monotonic() >= self.deadline:
+            raise TimeoutError
+        if self.connection is None:
+            self.connection = http.client.HTTPConnection('127.0.0.1', self.port, timeout=120)
+        start = time.perf_counter()
+        try:
+            self.connection.request('GET', path, headers={'Accept-Encoding': 'gzip'})
+            response = self.connection.getresponse()
+            body = response.read()
+            status = response.status
+            if response.will_close:
+                self.connection.close()
+                self.connection = None
+        except (OSError, http.client.HTTPException):
+            self.connection.close()
+            self.connection = None
+            response, status, body = None, None, b''
+        self.results.append((endpoint, status, time.perf_counter() - start))
+        if response is not None and response.getheader('Content-Encoding') == 'gzip':
+            body = gzip.decompress(body)
+        return status, body
+
+    def session(self):
+        status, body = self.get('/list_data_files', '/list_data_files')
+        if status != 200:
+            return
+        timestamps = [name.split('.')[0] for name in json.loads(body)]
+        for _ in range(TIMESTAMP_CHANGES):
+            timestamp = self.rng.choice(timestamps)
+            self.get('/api/geojson', f'/api/geojson?timestamp={timestamp}')
+            status, body = self.get('/api/temperature', f'/api/temperature?timestamp={timestamp}')
+            self.get('/api/wind', f'/api/wind?timestamp={timestamp}')
+            if status != 200:
+                continue
+            codes = [item['code'] for item in json.loads(body)]
+            for code in self.rng.sample(codes, min(CLICKS, len(codes))):
+                self.get('/generate_svg', f'/generate_svg?code={int(code)}&timestamp={timestamp}')
+
+    def run(self):
+        try:
+            while True:
+                self.session()
+        except TimeoutError:
+            pass
+
+def percentile(values, p):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[max(math.ceil(p / 100 * len(values)) - 1, 0)]
+
+def summarise(results):
+    by_endpoint = defaultdict(list)
+    for endpoint, status, seconds in results:
+        by_endpoint[endpoint].append((status, seconds))
+        by_endpoint['all'].append((status, seconds))
+    summary = {}
+    for endpoint, rows in by_endpoint.items():
+        latencies = [seconds * 1000 for _, seconds in rows]
+        summary[endpoint] = {
+            'requests': len(rows),
+            'errors': sum(1 for status, _ in rows if status is None or status >= 400),
+            'p50_ms': round(percentile(latencies, 50), 1),
+            'p95_ms': round(percentile(latencies, 95), 1),
+            'p99_ms': round(percentile(latencies, 99), 1),
+        }
+    return summary
+
+def run(workspace, workers, concurrency, duration, warmup, mode):
+    port = free_port()
+    server = start_server(workspace, port, workers, mode)
+    try:
+        wait_ready(server, port, workers)
+        if warmup > 0:
+            users = [VirtualUser(port, time.monotonic() + warmup, i, []) for i in range(concurrency)]
+            for user in users:
+                user.start()
+            for user in users:
+                user.join()
+
+        sampler = WorkerSampler(server.pid)
+        sampler.sample()
+        sampler.start()
+        results = []
+        start = time.monotonic()
+        users = [VirtualUser(port, start + duration, 1000 + i, results) for i in range(concurrency)]
+        for user in users:
+            user.start()
+        for user in users:
+            user.join()
+        elapsed = time.monotonic() - start
+        worker_stats = sampler.finish(elapsed)
+    finally:
+        stop_server(server)
+
+    summary = summarise(results)
+    return {
+        'workers': workers,
+        'concurrency': concurrency,
+        'mode': mode,
+        'seconds': round(elapsed, 2),
+        'throughput_rps': round(len(results) / elapsed, 2),
+        'endpoints': summary,
+        'gunicorn_workers': worker_stats,
+    }
+
+def print_run(result):
+    total = result['endpoints'].get('all', {'requests': 0, 'errors': 0})
+    print(f"\nworkers={result['workers']} concurrency={result['concurrency']} ({result['mode']}): "
+          f"{total['requests']} requests in {result['seconds']}s, {result['throughput_rps']} req/s, "
+          f"{total['errors']} errors")
+    print(f"  {'endpoint':<20}{'requests':>9}{'errors':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for endpoint, s in sorted(result['endpoints'].items(), key=lambda item: item[0] != 'all'):
+        print(f"  {endpoint:<20}{s['requests']:>9}{s['errors']:>8}{s['p50_ms']:>10}{s['p95_ms']:>10}{s['p99_ms']:>10}")
+    for pid, w in sorted(result['gunicorn_workers'].items()):
+        print(f"  worker {pid}: peak RSS {w['peak_rss_mb']} MiB, CPU {w['cpu_seconds']}s ({w['cpu_percent']}%)")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--workers', type=int, nargs='+', default=[2], help='gunicorn worker counts to test')
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[4], help='virtual user counts to test')
+    parser.add_argument('--duration', type=float, default=30.0, help='measured seconds per run')
+    parser.add_argument('--warmup', type=float, default=5.0, help='unmeasured seconds before each run')
+    parser.add_argument('--mode', nargs='+', default=['sync'], choices=['sync', 'async'], help='SERVING_MODE values to test')
+    parser.add_argument('--output', default='loadtest_results.json')
+    args = parser.parse_args()
+
+    workspace = prepare_workspace()
+    runs = []
+    try:
+        for mode in args.mode:
+            for workers in args.workers:
+                for concurrency in args.concurrency:
+                    result = run(workspace, workers, concurrency, args.duration, args.warmup, mode)
+                    print_run(result)
+                    runs.append(result)
+    finally:
+        shutil.rmtree(workspace, ignore_errors=True)
+    with open(args.output, 'w') as f:
+        json.dump({'cpu_count': os.cpu_count(), 'runs': runs}, f, indent=2)
+    print(f"\nResults saved to {args.output}")
+
+if __name__ == '__main__':
+    main()
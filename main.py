@@ -1,8 +1,16 @@
 from download_synop import download_file
 from python.decoding import process_synop_files
-from python.contours import generate_geojson
+from python.contours import generate_geojson, generate_field_grids
+from python.derived import generate_change_fields
+from python.animation import delete_frames, precompute_frame
+from python.wind import generate_wind
+from python.tiles import generate_tiles, delete_old_tiles
 from datetime import datetime, timedelta, timezone
 from python.delete import delete_file
+from python.timeseries import delete_old_chunks
+from python.catalog import add_products, compact_cycles, expire_cycles, is_published, publish_cycle
+from python.metrics import flush, timer, profile_requested, sampling_profiler, PROFILE_FLAG, PROFILE_DIR
+from contextlib import nullcontext
 import time,os
 
 def main():
@@ -11,20 +19,34 @@ def main():
     print(hour)
     interval_start_hour = (hour // 3) * 3
     timestamp = now.replace(hour=interval_start_hour, minute=0, second=0, microsecond=0).strftime("%Y%m%d%H")
-    if str(hour)=="00":
-        delete_file("Decoded_Data")
-        delete_file("contours_data")
-        delete_file("Synop")
+    if hour == 0:
+        compact_cycles()
+        expire_cycles()
+        delete_file("animation_cache")
+        delete_old_tiles()
+        delete_old_chunks()
 
-    json_file_path = f"contours_data/{timestamp}.geojson"  
-    if os.path.exists(json_file_path):
+    if is_published(timestamp):
         print("Data already downloaded")
         download_success = False
     else:
         print("Running download_synop...")
         download_success = download_file(timestamp)
+        if download_success:
+            add_products(timestamp, {'raw': f"Synop/{timestamp}syn.txt"})
 
     if download_success:
+        if profile_requested():
+            os.remove(PROFILE_FLAG)
+            profiler = sampling_profiler(os.path.join(PROFILE_DIR, f"{timestamp}.folded"))
+        else:
+            profiler = nullcontext()
+        with profiler:
+            process_cycle(timestamp)
+    flush()
+
+def process_cycle(timestamp):
+    with timer('pipeline_stage_seconds', stage='cycle'):
         print("decoding...")
         station_codes_file = "static/WMO_stations_data.csv"
         directory = 'Synop'
@@ -33,7 +55,24 @@ def main():
         
         print("Generating Contours...")
         generate_geojson(timestamp)
-    
+        generate_field_grids(timestamp)
+
+        print("Generating wind...")
+        generate_wind(timestamp)
+
+        print("Generating change fields...")
+        generate_change_fields(timestamp)
+
+        publish_cycle(timestamp)
+        # Frames cached from an earlier publication of this cycle are out of date
+        delete_frames(timestamp)
+
+        print("Caching animation frames...")
+        precompute_frame(timestamp)
+
+        print("Rendering tiles...")
+        generate_tiles(timestamp)
+
 def schedule_task():
     while True:
         now = datetime.now(timezone.utc)
@@ -0,0 +1,139 @@
+import os,io,json
+import numpy as np
+import pandas as pd
+from datetime import datetime, timedelta
+from python.metrics import inc
+from python.archive import read_product
+
+# Frames for stepping through cycles. The first frame of a sequence is a
+# keyframe; later frames only carry the stations whose temperature changed
+# and those added or removed since the frame before. Contours are redrawn
+# every cycle, so every frame carries all of its lines, with coordinates
+# quantised to COORD_SCALE and stored as [level, x0, y0, dx1, dy1, ...]
+# integer runs.
+FRAME_DIR = 'animation_cache'
+COORD_SCALE = 1000
+STATION_COLUMNS = ['code', 'lat', 'lon', 'temp', 'station']
+
+
+def read_stations(timestamp):
+    data_file = f"Decoded_Data/{timestamp}.csv"
+    if os.path.exists(data_file):
+        data = pd.read_csv(data_file)
+    else:
+        archived = read_product(timestamp, 'csv')
+        if archived is None:
+            return None
+        data = pd.read_csv(io.BytesIO(archived))
+    data = data.dropna(subset=['air_temp']).drop_duplicates(subset='station_id')
+    return {
+        'code': data['station_id'].astype(int).tolist(),
+        'lat': data['Latitude'].round(4).tolist(),
+        'lon': data['Longitude'].round(4).tolist(),
+        'temp': data['air_temp'].round(1).tolist(),
+        'station': data['Station_Name'].tolist(),
+    }
+
+def encode_line(level, coords):
+    points = np.rint(np.asarray(coords, dtype=float) * COORD_SCALE).astype(np.int64)
+    deltas = np.diff(points, axis=0, prepend=np.zeros((1, 2), dtype=np.int64))
+    return [int(level)] + deltas.ravel().tolist()
+
+def read_contours(timestamp):
+    json_path = f"contours_data/{timestamp}.geojson"
+    if os.path.exists(json_path):
+        with open(json_path, 'r') as f:
+            geojson = json.load(f)
+    else:
+        archived = read_product(timestamp, 'geojson')
+        if archived is None:
+            return None
+        geojson = json.loads(archived)
+    return [encode_line(feature['properties']['level'], feature['geometry']['coordinates'])
+            for feature in geojson['features']]
+
+def keyframe(timestamp, stations, lines):
+    return {'timestamp': str(timestamp), 'key': True, 'stations': stations, 'lines': lines}
+
+def delta_frame(timestamp, previous, stations, prev_stations, lines):
+    prev_temp = dict(zip(prev_stations['code'], prev_stations['temp']))
+    current_codes = set(stations['code'])
+    changed, added = [], {column: [] for column in STATION_COLUMNS}
+    for row in zip(*(stations[column] for column in STATION_COLUMNS)):
+        code, temp = row[0], row[3]
+        if code not in prev_temp:
+            for column, value in zip(STATION_COLUMNS, row):
+                added[column].append(value)
+        elif prev_temp[code] != temp:
+            changed.append([code, temp])
+    removed = [code for code in prev_stations['code'] if code not in current_codes]
+    return {
+        'timestamp': str(timestamp),
+        'previous': str(previous),
+        'key': False,
+        'stations': {'set': changed, 'add': added, 'del': removed},
+        'lines': lines,
+    }
+
+def frame_path(timestamp, previous=None):
+    name = f'{timestamp}.json' if previous is None else f'{timestamp}_{previous}.json'
+    return os.path.join(FRAME_DIR, name)
+
+def build_frame(timestamp, previous=None):
+    """Build and cache a keyframe, or a delta frame against `previous`. Returns the JSON text."""
+    # python.catalog imports python.wind, which imports this module
+    from python.catalog import is_current
+    path = frame_path(timestamp, previous)
+    if is_current(path, *[cycle for cycle in (timestamp, previous) if cycle is not None]):
+        inc('cache_requests_total', cache='animation_frames', result='hit')
+        with open(path, 'r') as f:
+            return f.read()
+    inc('cache_requests_total', cache='animation_frames', result='miss')
+
+    stations, lines = read_stations(timestamp), read_contours(timestamp)
+    if stations is None or lines is None:
+        return None
+    if previous is None:
+        frame = keyframe(timestamp, stations, lines)
+    else:
+        prev_stations = read_stations(previous)
+        if prev_stations is None:
+            return build_frame(timestamp)
+        frame = delta_frame(timestamp, previous, stations, prev_stations, lines)
+
+    text = json.dumps(frame, separators=(',', ':'))
+    os.makedirs(FRAME_DIR, exist_ok=True)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        f.write(text)
+    os.replace(tmp_path, path)
+    return text
+
+def delete_frames(timestamp):
+    """Remove the cached frames built from a cycle, for when it is republished."""
+    if not os.path.isdir(FRAME_DIR):
+        return
+    for filename in os.listdir(FRAME_DIR):
+        if filename.startswith(f'{timestamp}') or filename.endswith(f'_{timestamp}.json'):
+            os.remove(os.path.join(FRAME_DIR, filename))
+
+def cycles_in_range(start, end, cycles):
+    """The listed cycles from start to end inclusive, all YYYYMMDDHH strings."""
+    return [timestamp for timestamp in cycles if start <= timestamp <= end]
+
+def animation_frames(timestamps):
+    """Yield newline-delimited frames: a keyframe, then deltas against the previous available cycle."""
+    previous = None
+    for timestamp in timestamps:
+        text = build_frame(timestamp, previous)
+        if text is None:
+            continue
+        yield text + '\n'
+        previous = timestamp
+
+def precompute_frame(timestamp, step_hours=3):
+    """Cache the keyframe and the delta from the previous cycle once a cycle is published."""
+    previous = (datetime.strptime(str(timestamp), "%Y%m%d%H") - timedelta(hours=step_hours)).strftime("%Y%m%d%H")
+    build_frame(timestamp)
+    if os.path.exists(f"contours_data/{previous}.geojson"):
+        build_frame(timestamp, previous)
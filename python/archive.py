@@ -0,0 +1,116 @@
+import os,json,struct,hashlib
+import zstandard
+
+# Cold storage for cycles past the retention window. Each month is one
+# file, ARCHIVE_DIR/<YYYYMM>.zst, in which every archived file of every
+# cycle is its own zstd frame. After the frames comes a zstd-compressed
+# JSON index of "<timestamp>/<product>" -> [offset, length, size, sha256]
+# and a footer pointing at it, so a product is read with one seek and the
+# decompression of its own frame. Compaction appends new frames after the
+# old index and then writes a new index and footer; if an append is cut
+# short, readers and the next append fall back to the last whole footer.
+ARCHIVE_DIR = os.environ.get('ARCHIVE_DIR', 'archive')
+ARCHIVE_LEVEL = int(os.environ.get('ARCHIVE_ZSTD_LEVEL', 19))
+FOOTER = struct.Struct('<QQ8s')  # index offset, index length, magic
+MAGIC = b'WXARCHV1'
+SCAN_BLOCK = 1 << 20  # bytes read at a time when looking back for a whole footer
+
+_indexes = {}  # path -> ((mtime_ns, size), index)
+
+
+def archive_path(timestamp):
+    return os.path.join(ARCHIVE_DIR, f'{str(timestamp)[:6]}.zst')
+
+def product_key(timestamp, product):
+    return f'{timestamp}/{product}'
+
+def _parse_footer(f, footer, end):
+    """The index a footer ending at `end` points to, or None if it is not a whole footer."""
+    index_offset, index_length, magic = FOOTER.unpack(footer)
+    if magic != MAGIC or index_offset + index_length != end - FOOTER.size:
+        return None
+    f.seek(index_offset)
+    try:
+        return json.loads(zstandard.ZstdDecompressor().decompress(f.read(index_length)))
+    except (zstandard.ZstdError, ValueError):
+        return None
+
+def _read_index(f, size):
+    """(index, end of its footer) of an open archive."""
+    if size >= FOOTER.size:
+        f.seek(size - FOOTER.size)
+        index = _parse_footer(f, f.read(FOOTER.size), size)
+        if index is not None:
+            return index, size
+    # The last append did not finish: find the footer written before it,
+    # reading backwards a block at a time. Blocks overlap by len(MAGIC) - 1
+    # bytes so a magic split across two of them is still found.
+    block_end = size
+    while block_end > 0:
+        block_start = max(0, block_end - SCAN_BLOCK)
+        f.seek(block_start)
+        block = f.read(min(size, block_end + len(MAGIC) - 1) - block_start)
+        position = block.rfind(MAGIC)
+        while position >= 0:
+            end = block_start + position + len(MAGIC)
+            if end >= FOOTER.size:
+                f.seek(end - FOOTER.size)
+                index = _parse_footer(f, f.read(FOOTER.size), end)
+                if index is not None:
+                    print(f"Archive {f.name} has an incomplete append after byte {end}")
+                    return index, end
+            position = block.rfind(MAGIC, 0, position)
+        block_end = block_start
+    return {}, 0
+
+def read_index(path):
+    """The index of an archive, cached until the file changes. Empty if there is no archive."""
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return {}
+    version = (stat.st_mtime_ns, stat.st_size)
+    cached = _indexes.get(path)
+    if cached is None or cached[0] != version:
+        with open(path, 'rb') as f:
+            cached = (version, _read_index(f, stat.st_size)[0])
+        _indexes[path] = cached
+    return cached[1]
+
+def has_product(timestamp, product):
+    return product_key(timestamp, product) in read_index(archive_path(timestamp))
+
+def read_product(timestamp, product):
+    """Bytes of an archived file, or None if it is not archived."""
+    path = archive_path(timestamp)
+    entry = read_index(path).get(product_key(timestamp, product))
+    if entry is None:
+        return None
+    offset, length = entry[0], entry[1]
+    with open(path, 'rb') as f:
+        f.seek(offset)
+        return zstandard.ZstdDecompressor().decompress(f.read(length))
+
+def append_products(path, items, level=ARCHIVE_LEVEL):
+    """Add (timestamp, product, bytes) items to an archive, replacing earlier
+    copies in its index. Returns the new index entries by key."""
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    compressor = zstandard.ZstdCompressor(level=level)
+    entries = {}
+    with open(path, 'r+b' if os.path.exists(path) else 'w+b') as f:
+        index, end = _read_index(f, f.seek(0, os.SEEK_END))
+        f.truncate(end)
+        f.seek(end)
+        for timestamp, product, data in items:
+            frame = compressor.compress(data)
+            entries[product_key(timestamp, product)] = [f.tell(), len(frame), len(data), hashlib.sha256(data).hexdigest()]
+            f.write(frame)
+        index.update(entries)
+        index_frame = compressor.compress(json.dumps(index, sort_keys=True).encode())
+        index_offset = f.tell()
+        f.write(index_frame)
+        f.write(FOOTER.pack(index_offset, len(index_frame), MAGIC))
+        f.flush()
+        os.fsync(f.fileno())
+    _indexes.pop(path, None)
+    return entries
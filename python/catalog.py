@@ -0,0 +1,261 @@
+import os,re,time,fcntl,sqlite3,hashlib
+from collections import defaultdict
+from contextlib import closing
+from datetime import datetime, timedelta, timezone
+from python.contours import GRID_FIELDS, grid_path, grid_meta_path
+from python.derived import CHANGE_FIELDS, CHANGE_HOURS, change_geojson_path
+from python.wind import wind_path
+from python.archive import archive_path, append_products, read_product
+
+# Catalog of cycles and the files produced for them, in one SQLite file
+# shared by the pipeline and every gunicorn worker. The raw bulletin is
+# registered when it is downloaded; the pipeline publishes a cycle in one
+# transaction once its products are written, recording their sizes and
+# checksums and bumping the cycle's version. Listing, retention and cache
+# invalidation query it instead of scanning the data directories. Caches
+# filled after publication (animation frames, tiles) are not products.
+# Before a cycle expires, its raw bulletin, CSV and contours are packed
+# into the monthly archive (python/archive.py); such a cycle stays listed
+# and its products record the archive they are in.
+CATALOG_PATH = os.environ.get('CATALOG_PATH', 'catalog.sqlite')
+RETENTION_DAYS = 10
+SCHEMA_VERSION = 2
+# Products a cycle needs before it is listed
+REQUIRED_PRODUCTS = ('raw', 'csv', 'geojson')
+ARCHIVED_PRODUCTS = ('raw', 'csv', 'geojson')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS cycles (
+    timestamp INTEGER PRIMARY KEY,
+    version INTEGER NOT NULL DEFAULT 0,
+    published_at REAL,
+    complete INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS products (
+    timestamp INTEGER NOT NULL REFERENCES cycles(timestamp),
+    product TEXT NOT NULL,
+    path TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    sha256 TEXT NOT NULL,
+    version INTEGER NOT NULL,
+    archive TEXT,
+    PRIMARY KEY (timestamp, product)
+);
+CREATE INDEX IF NOT EXISTS cycles_complete ON cycles(complete, timestamp);
+"""
+
+_schema_ready = None
+
+
+def _prepare(connection):
+    connection.execute('PRAGMA journal_mode=WAL')
+    version = connection.execute('PRAGMA user_version').fetchone()[0]
+    if version == 1:
+        connection.execute('ALTER TABLE products ADD COLUMN archive TEXT')
+    connection.executescript(SCHEMA)
+    connection.execute(f'PRAGMA user_version={SCHEMA_VERSION}')
+
+def _create(path):
+    """Build a missing catalog from the cycles on disk. Whichever process opens
+    it first does this (the web app runs without the scheduler), under a lock
+    and into a temporary file, so no one lists a half-built catalog."""
+    global _schema_ready
+    with open(path + '.lock', 'w') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        if os.path.exists(path):
+            return
+        tmp_path = path + '.tmp'
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(tmp_path + suffix):
+                os.remove(tmp_path + suffix)
+        with closing(sqlite3.connect(tmp_path, timeout=30)) as connection:
+            _prepare(connection)
+        _schema_ready = tmp_path
+        try:
+            build_catalog(tmp_path)
+        finally:
+            _schema_ready = None
+        os.replace(tmp_path, path)
+
+def connect(path=None):
+    global _schema_ready
+    path = path or CATALOG_PATH
+    if _schema_ready != path and not os.path.exists(path):
+        _create(path)
+    connection = sqlite3.connect(path, timeout=30)
+    if _schema_ready != path:
+        _prepare(connection)
+        _schema_ready = path
+    return connection
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+def cycle_products(timestamp):
+    """product name -> path of every file the pipeline writes for a cycle that exists."""
+    products = {
+        'raw': os.path.join('Synop', f'{timestamp}syn.txt'),
+        'csv': os.path.join('Decoded_Data', f'{timestamp}.csv'),
+        'geojson': os.path.join('contours_data', f'{timestamp}.geojson'),
+        'wind': wind_path(timestamp),
+    }
+    grids = ['pressure_sea_level'] + GRID_FIELDS + ['wind_u', 'wind_v']
+    for hours in CHANGE_HOURS:
+        for name in CHANGE_FIELDS:
+            grids.append(f'{name}_{hours}h')
+            products[f'change_{name}_{hours}h'] = change_geojson_path(timestamp, name, hours)
+    for name in grids:
+        products[f'grid_{name}'] = grid_path(timestamp, name)
+        products[f'grid_{name}_meta'] = grid_meta_path(timestamp, name)
+    for name, path in list(products.items()):
+        if path.endswith('.geojson'):
+            products[f'{name}_gz'] = path + '.gz'
+    return {name: path for name, path in products.items() if os.path.exists(path)}
+
+def _record(connection, timestamp, products, version):
+    rows = [(int(timestamp), name, path, os.path.getsize(path), file_sha256(path), version)
+            for name, path in products.items()]
+    connection.executemany('INSERT OR REPLACE INTO products (timestamp, product, path, size, sha256, version) '
+                           'VALUES (?, ?, ?, ?, ?, ?)', rows)
+
+def add_products(timestamp, products, path=None):
+    """Register files of a cycle that is not published yet, such as its raw bulletin."""
+    with closing(connect(path)) as connection, connection:
+        connection.execute('INSERT OR IGNORE INTO cycles (timestamp) VALUES (?)', (int(timestamp),))
+        version = connection.execute('SELECT version FROM cycles WHERE timestamp = ?', (int(timestamp),)).fetchone()[0]
+        _record(connection, timestamp, products, version)
+
+def publish_cycle(timestamp, products=None, published_at=None, path=None):
+    """Record a cycle's products and make it visible, all in one transaction. Returns its new version."""
+    products = cycle_products(timestamp) if products is None else products
+    with closing(connect(path)) as connection, connection:
+        connection.execute('INSERT OR IGNORE INTO cycles (timestamp) VALUES (?)', (int(timestamp),))
+        version = connection.execute('SELECT version FROM cycles WHERE timestamp = ?', (int(timestamp),)).fetchone()[0] + 1
+        connection.execute('DELETE FROM products WHERE timestamp = ?', (int(timestamp),))
+        _record(connection, timestamp, products, version)
+        complete = all(name in products for name in REQUIRED_PRODUCTS)
+        connection.execute('UPDATE cycles SET version = ?, published_at = ?, complete = ? WHERE timestamp = ?',
+                           (version, published_at or time.time(), int(complete), int(timestamp)))
+    print(f"Published cycle {timestamp} version {version} with {len(products)} products")
+    return version
+
+def list_cycles(path=None):
+    """Timestamps of the complete cycles, oldest first."""
+    with closing(connect(path)) as connection:
+        return [str(row[0]) for row in connection.execute('SELECT timestamp FROM cycles WHERE complete = 1 ORDER BY timestamp')]
+
+def cycle_info(timestamp, path=None):
+    """(version, published_at) of a published cycle, or None."""
+    if timestamp is None:
+        return None
+    with closing(connect(path)) as connection:
+        row = connection.execute('SELECT version, published_at FROM cycles WHERE timestamp = ? AND published_at IS NOT NULL',
+                                 (int(timestamp),)).fetchone()
+    return row
+
+def cycle_version(timestamp, path=None):
+    info = cycle_info(timestamp, path)
+    return info[0] if info else 0
+
+def is_published(timestamp, path=None):
+    return cycle_info(timestamp, path) is not None
+
+def is_current(file_path, *timestamps):
+    """Whether a file derived from these cycles was written after each was last
+    published, so no republication has replaced its inputs. False if it is missing."""
+    try:
+        mtime = os.stat(file_path).st_mtime
+    except FileNotFoundError:
+        return False
+    for timestamp in timestamps:
+        info = cycle_info(timestamp)
+        if info is not None and mtime < info[1]:
+            return False
+    return True
+
+def retention_cutoff(days=RETENTION_DAYS, now=None):
+    """Latest timestamp that is more than `days` days old."""
+    now = now or datetime.now(timezone.utc)
+    return int((now - timedelta(days=days + 1)).strftime("%Y%m%d%H"))
+
+def compact_cycles(days=RETENTION_DAYS, now=None, path=None):
+    """Move the ARCHIVED_PRODUCTS of published cycles past the retention
+    window into their monthly archives. The files are deleted once they read
+    back from the archive, and the products' path becomes the archive's."""
+    cutoff = retention_cutoff(days, now)
+    placeholders = ','.join('?' * len(ARCHIVED_PRODUCTS))
+    with closing(connect(path)) as connection:
+        rows = connection.execute(
+            'SELECT products.timestamp, product, path FROM products JOIN cycles USING (timestamp) '
+            f'WHERE products.timestamp <= ? AND archive IS NULL AND published_at IS NOT NULL AND product IN ({placeholders}) '
+            'ORDER BY products.timestamp, product', (cutoff,) + ARCHIVED_PRODUCTS).fetchall()
+        cycles = defaultdict(list)
+        for timestamp, product, file_path in rows:
+            if os.path.exists(file_path):
+                cycles[timestamp].append((product, file_path))
+
+        # One append per cycle keeps memory to a cycle's files
+        for timestamp, products in cycles.items():
+            items = []
+            for product, file_path in products:
+                with open(file_path, 'rb') as f:
+                    items.append((timestamp, product, f.read()))
+            archive_file = archive_path(timestamp)
+            append_products(archive_file, items)
+            # Only files that read back from the archive may be deleted
+            for _, product, data in items:
+                if read_product(timestamp, product) != data:
+                    raise IOError(f"Archived {product} of {timestamp} does not match {archive_file}")
+            with connection:
+                connection.executemany('UPDATE products SET archive = ?, path = ? WHERE timestamp = ? AND product = ?',
+                                       [(archive_file, archive_file, timestamp, product) for _, product, _ in items])
+            for _, file_path in products:
+                os.remove(file_path)
+    if cycles:
+        print(f"Archived {len(cycles)} cycles")
+    return len(cycles)
+
+def expire_cycles(days=RETENTION_DAYS, now=None, path=None):
+    """Delete the files of cycles more than `days` days old, published or not,
+    and their catalog rows. Archived products were moved by compact_cycles and stay."""
+    cutoff = retention_cutoff(days, now)
+    with closing(connect(path)) as connection:
+        deleted = 0
+        for (file_path,) in connection.execute('SELECT path FROM products WHERE timestamp <= ? AND archive IS NULL',
+                                               (cutoff,)).fetchall():
+            try:
+                os.remove(file_path)
+                deleted += 1
+            except FileNotFoundError:
+                pass
+        with connection:
+            connection.execute('DELETE FROM products WHERE timestamp <= ? AND archive IS NULL', (cutoff,))
+            removed = connection.execute('DELETE FROM cycles WHERE timestamp <= ? AND timestamp NOT IN '
+                                         '(SELECT timestamp FROM products)', (cutoff,)).rowcount
+    print(f"Expired {removed} cycles, deleted {deleted} files up to {cutoff}")
+    return removed
+
+def build_catalog(path=None):
+    """Catalog the cycles already on disk, for deployments that predate the catalog."""
+    timestamps = set()
+    for directory in ('Synop', 'Decoded_Data', 'contours_data'):
+        if not os.path.isdir(directory):
+            continue
+        for filename in os.listdir(directory):
+            match = re.match(r'\d{10}', filename)
+            if match:
+                timestamps.add(match.group())
+    for timestamp in sorted(timestamps):
+        products = cycle_products(timestamp)
+        if all(name in products for name in REQUIRED_PRODUCTS):
+            publish_cycle(timestamp, products, published_at=os.path.getmtime(products['geojson']), path=path)
+        else:
+            add_products(timestamp, products, path=path)
+    return len(timestamps)
+
+if __name__ == '__main__':
+    build_catalog()
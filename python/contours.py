@@ -1,29 +1,50 @@
 import pandas as pd
 import numpy as np
 import matplotlib.pyplot as plt
-from scipy.spatial import cKDTree
+from scipy.spatial import cKDTree, ConvexHull
+from matplotlib.path import Path
 import scipy as sp
-import json,os,random
+import json,os,io,random,gzip
 import re
 import matplotlib
+from python.metrics import inc, timer
+from python.archive import read_product
 matplotlib.use('Agg')  # Use the non-GUI Agg backend
 
 
-def idw_interpolation(x, y, z, xi, yi, power=3, chunk_size=10000):
-    tree = cKDTree(np.c_[x, y])
+# Station distances are measured between unit vectors on the sphere, so a
+# degree of longitude counts for cos(latitude) of a degree of latitude and
+# stations either side of the dateline are neighbours. Distances given in
+# degrees (GRID_MASK_DEGREES) are arcs, compared as the chords they subtend.
+def sphere_points(lons, lats):
+    lon, lat = np.radians(lons), np.radians(lats)
+    return np.c_[np.cos(lat) * np.cos(lon), np.cos(lat) * np.sin(lon), np.sin(lat)]
+
+def arc_chord(degrees):
+    return 2 * np.sin(np.radians(np.minimum(degrees, 180.0)) / 2)
+
+def chord_arc(chord):
+    return np.degrees(2 * np.arcsin(np.minimum(chord / 2, 1.0)))
+
+def idw_interpolation(x, y, z, xi, yi, power=3, chunk_size=10000, tree=None):
+    if tree is None:
+        tree = cKDTree(sphere_points(x, y))
     zi = np.zeros(len(xi))
     for i in range(0, len(xi), chunk_size):
         xi_chunk = xi[i:i + chunk_size]
         yi_chunk = yi[i:i + chunk_size]
-        distances, indices = tree.query(np.c_[xi_chunk, yi_chunk], k=min(10, len(x)), p=2, workers=-1)
+        distances, indices = tree.query(sphere_points(xi_chunk, yi_chunk), k=min(10, tree.n), p=2, workers=-1)
         weights = 1 / (distances + 1e-12) ** power
         weights /= weights.sum(axis=1)[:, np.newaxis]
         zi[i:i + chunk_size] = np.sum(weights * z[indices], axis=1)
     return zi
 
 def contours_to_geojson(contour_set):
+    return lines_to_geojson(contour_set.levels, contour_set.allsegs)
+
+def lines_to_geojson(levels, allsegs):
     features = []
-    for level, segs in zip(contour_set.levels, contour_set.allsegs):
+    for level, segs in zip(levels, allsegs):
         for seg in segs:
             coords = [[pt[0], pt[1]] for pt in seg if pt[0] is not None and pt[1] is not None]
             if len(coords) > 0:
@@ -55,6 +76,10 @@ def contours_to_geojson(contour_set):
 def read_data(timestamp):
     try:
         data_file = f"Decoded_Data/{timestamp}.csv"
+        if not os.path.exists(data_file):
+            archived = read_product(timestamp, 'csv')
+            if archived is not None:
+                return pd.read_csv(io.BytesIO(archived))
         data = pd.read_csv(data_file)
         return data
     except FileNotFoundError:
@@ -62,6 +87,306 @@ def read_data(timestamp):
     except Exception as e:
         print("An error occurred:", str(e))
 
+GRID_SIZE = 1000
+GRID_DIR = 'grids_data'
+GRID_ALIASES = {'pressure': 'pressure_sea_level', 'temperature': 'air_temp'}
+
+# Masked gridding: 'none' fills the whole station rectangle, 'distance' only
+# cells within GRID_MASK_DEGREES of the nearest station, 'hull' the stations'
+# convex hull plus that margin. Masked cells are NaN.
+GRID_MASK = os.environ.get('GRID_MASK', 'none')
+GRID_MASK_DEGREES = float(os.environ.get('GRID_MASK_DEGREES', 3.0))
+MASK_BLOCK = 10
+
+def distance_mask(tree, lon_arr, lat_arr, max_distance, block=MASK_BLOCK):
+    """Grid cells within max_distance of the nearest station in `tree`.
+
+    Distances are queried once per block x block group of cells. A block whose
+    centre is clearly inside or outside is decided as a whole (the distance to
+    the nearest station changes by at most the distance moved); only blocks
+    on the edge of the mask are queried cell by cell."""
+    nlon, nlat = len(lon_arr), len(lat_arr)
+    starts_i, starts_j = np.arange(0, nlon, block), np.arange(0, nlat, block)
+    centre_lon = (lon_arr[starts_i] + lon_arr[np.minimum(starts_i + block, nlon) - 1]) / 2
+    centre_lat = (lat_arr[starts_j] + lat_arr[np.minimum(starts_j + block, nlat) - 1]) / 2
+    # A step in lon/lat degrees is never a longer arc than the same step in latitude
+    radius = arc_chord(np.hypot(abs(lon_arr[-1] - lon_arr[0]) / max(nlon - 1, 1),
+                                abs(lat_arr[-1] - lat_arr[0]) / max(nlat - 1, 1)) * (block - 1) / 2)
+    max_distance = arc_chord(max_distance)
+    lat_centres, lon_centres = np.meshgrid(centre_lat, centre_lon)
+    distance, _ = tree.query(sphere_points(lon_centres.ravel(), lat_centres.ravel()), k=1,
+                             distance_upper_bound=max_distance + radius, workers=-1)
+    distance = distance.reshape(lon_centres.shape)
+
+    def expand(blocks):
+        return np.repeat(np.repeat(blocks, block, axis=0), block, axis=1)[:nlon, :nlat]
+    mask = expand(distance + radius <= max_distance)
+    edge = expand((distance - radius <= max_distance) & (distance + radius > max_distance))
+    ii, jj = np.nonzero(edge)
+    if len(ii):
+        cell_distance, _ = tree.query(sphere_points(lon_arr[ii], lat_arr[jj]), k=1,
+                                      distance_upper_bound=max_distance, workers=-1)
+        mask[ii, jj] = cell_distance <= max_distance
+    return mask
+
+def hull_mask(lons, lats, lon_arr, lat_arr):
+    """Grid cells inside the convex hull of the stations."""
+    points = np.c_[lons, lats]
+    hull = Path(points[ConvexHull(points).vertices])
+    lat_grid, lon_grid = np.meshgrid(lat_arr, lon_arr)
+    return hull.contains_points(np.c_[lon_grid.ravel(), lat_grid.ravel()]).reshape(lon_grid.shape)
+
+def grid_mask(tree, lons, lats, lon_arr, lat_arr, mode, max_distance=GRID_MASK_DEGREES):
+    """Boolean mask of the cells to interpolate, or None to fill the whole grid."""
+    if mode == 'none':
+        return None
+    mask = distance_mask(tree, lon_arr, lat_arr, max_distance)
+    if mode == 'hull' and len(lons) >= 3:
+        mask |= hull_mask(lons, lats, lon_arr, lat_arr)
+    return mask
+
+def masked_gaussian_filter(grid, mask, sigma):
+    """Gaussian smoothing that only averages over unmasked cells, so NaNs do not spread."""
+    weights = sp.ndimage.gaussian_filter(mask.astype(float), sigma=sigma)
+    smoothed = sp.ndimage.gaussian_filter(np.where(mask, grid, 0.0), sigma=sigma)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.where(mask, smoothed / weights, np.nan)
+
+def interpolate_grid(tree, lons, lats, values, lon_arr, lat_arr, mask, max_distance=GRID_MASK_DEGREES, hull=None):
+    """IDW values on the grid (NaN outside the mask) and the mask of interpolated cells.
+
+    `hull` is the (lons, lats) whose convex hull the 'hull' mask covers, by default the stations'."""
+    lat_grid, lon_grid = np.meshgrid(lat_arr, lon_arr)
+    lat_grid_flat, lon_grid_flat = lat_grid.flatten(), lon_grid.flatten()
+    cells = grid_mask(tree, *(hull or (lons, lats)), lon_arr, lat_arr, mask, max_distance)
+    if cells is None:
+        grid_flat = idw_interpolation(lons, lats, values, lon_grid_flat, lat_grid_flat, tree=tree)
+    else:
+        inside = cells.ravel()
+        grid_flat = np.full(len(lat_grid_flat), np.nan)
+        grid_flat[inside] = idw_interpolation(lons, lats, values, lon_grid_flat[inside], lat_grid_flat[inside], tree=tree)
+    return grid_flat.reshape(lat_grid.shape), cells
+
+def smooth_grid(grid, cells, sigma):
+    if cells is None:
+        return sp.ndimage.gaussian_filter(grid, sigma=sigma)
+    return masked_gaussian_filter(grid, cells, sigma)
+
+# Coarse-to-fine analysis: IDW on a grid a few cells per station spacing
+# (never coarser than the smoothing scale), smoothed there and upsampled with
+# a cubic spline. The result is checked against exactly computed
+# full-resolution patches and recomputed at full resolution if any checked
+# cell is off by more than GRID_COARSE_MAX_ERROR (in the field's units).
+GRID_ANALYSIS = os.environ.get('GRID_ANALYSIS', 'full')
+GRID_COARSE_MAX_ERROR = float(os.environ.get('GRID_COARSE_MAX_ERROR', 0.5))
+COARSE_STATION_CELLS = 5
+CHECK_PATCHES = 3
+CHECK_PATCH_SIZE = 32
+
+def coarse_shape(tree, lon_arr, lat_arr, sigma):
+    if tree.n < 2 or len(lon_arr) < 2 or len(lat_arr) < 2:
+        return None
+    distances, _ = tree.query(tree.data, k=2)
+    spacing = chord_arc(np.median(distances[:, 1]))
+    shape = []
+    for arr in (lon_arr, lat_arr):
+        span = abs(arr[-1] - arr[0])
+        step = min(spacing / COARSE_STATION_CELLS, sigma * span / (len(arr) - 1))
+        shape.append(int(np.clip(np.ceil(span / step) + 1 if step > 0 else len(arr), 2, len(arr))))
+    return tuple(shape)
+
+def coarse_error(tree, lons, lats, values, lon_arr, lat_arr, sigma, mask, grid, hull=None):
+    """Largest difference between grid and the full-resolution analysis over a few patches."""
+    radius = int(4 * sigma + 0.5)  # gaussian_filter's default truncation
+    worst = 0.0
+    starts = []
+    for n in grid.shape:
+        size = min(CHECK_PATCH_SIZE + 2 * radius, n)
+        starts.append((size, np.unique(np.linspace(0, n - size, CHECK_PATCHES).astype(int))))
+    (size_i, starts_i), (size_j, starts_j) = starts
+    for i0 in starts_i:
+        for j0 in starts_j:
+            patch, cells = interpolate_grid(tree, lons, lats, values, lon_arr[i0:i0 + size_i], lat_arr[j0:j0 + size_j], mask,
+                                            hull=hull)
+            patch = smooth_grid(patch, cells, sigma)
+            # Cells near a patch side that is inside the grid see a different neighbourhood
+            li, hi = (0 if i0 == 0 else radius), (size_i if i0 + size_i == grid.shape[0] else size_i - radius)
+            lj, hj = (0 if j0 == 0 else radius), (size_j if j0 + size_j == grid.shape[1] else size_j - radius)
+            diff = np.abs(patch[li:hi, lj:hj] - grid[i0 + li:i0 + hi, j0 + lj:j0 + hj])
+            if np.isfinite(diff).any():
+                worst = max(worst, float(np.nanmax(diff)))
+    return worst
+
+def coarse_analysis(tree, lons, lats, values, lon_arr, lat_arr, sigma, mask, max_error, hull=None):
+    """Coarse-to-fine grid, or None when it would not be cheaper or misses the error bound."""
+    shape = coarse_shape(tree, lon_arr, lat_arr, sigma)
+    if shape is None or shape[0] * shape[1] * 4 > len(lon_arr) * len(lat_arr):
+        return None
+    coarse_lon = np.linspace(lon_arr[0], lon_arr[-1], shape[0])
+    coarse_lat = np.linspace(lat_arr[0], lat_arr[-1], shape[1])
+    coarse_sigma = (sigma * (shape[0] - 1) / (len(lon_arr) - 1), sigma * (shape[1] - 1) / (len(lat_arr) - 1))
+    # Widen the coarse mask by a coarse cell so it covers every fine cell
+    margin = np.hypot(coarse_lon[1] - coarse_lon[0], coarse_lat[1] - coarse_lat[0])
+    grid, cells = interpolate_grid(tree, lons, lats, values, coarse_lon, coarse_lat, mask, GRID_MASK_DEGREES + margin, hull)
+    fine_cells = grid_mask(tree, *(hull or (lons, lats)), lon_arr, lat_arr, mask)
+    if cells is None:
+        grid = smooth_grid(grid, cells, coarse_sigma)
+    else:
+        # Weight coarse cells by how much of them the fine mask covers, so the
+        # smoothing sees the same boundary as the full-resolution analysis
+        block = (len(lon_arr) / shape[0], len(lat_arr) / shape[1])
+        coverage = sp.ndimage.uniform_filter(fine_cells.astype(float), size=[max(int(round(b)), 1) for b in block])
+        coverage = sp.ndimage.zoom(coverage, (shape[0] / len(lon_arr), shape[1] / len(lat_arr)), order=1, mode='nearest')
+        coverage = np.where(cells, np.clip(coverage, 0, 1), 0.0)
+        weights = sp.ndimage.gaussian_filter(coverage, sigma=coarse_sigma)
+        smoothed = sp.ndimage.gaussian_filter(np.where(cells, grid, 0.0) * coverage, sigma=coarse_sigma)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            grid = np.where(weights > 1e-6, smoothed / weights, np.nan)
+        # Fill the rest from the nearest smoothed cell so the spline never sees NaN
+        nearest = sp.ndimage.distance_transform_edt(np.isnan(grid), return_distances=False, return_indices=True)
+        grid = grid[tuple(nearest)]
+    grid = sp.ndimage.zoom(grid, (len(lon_arr) / shape[0], len(lat_arr) / shape[1]), order=3, mode='nearest')
+    if fine_cells is not None:
+        grid[~fine_cells] = np.nan
+
+    error = coarse_error(tree, lons, lats, values, lon_arr, lat_arr, sigma, mask, grid, hull)
+    if error > max_error:
+        print(f"Coarse analysis off by {error:.3f} (limit {max_error}), using full resolution")
+        inc('grid_coarse_fallbacks_total')
+        return None
+    return grid
+
+def analysis_grid(lons, lats, values, lon_arr=None, lat_arr=None, sigma=5, mask=None, mode=None, max_error=None,
+                  hull=None):
+    """IDW-interpolate station values onto a lon/lat grid and smooth it.
+
+    With a `mask` mode (default GRID_MASK) other than 'none' only cells near
+    the stations are interpolated and the rest of the grid is NaN. `mode`
+    (default GRID_ANALYSIS) is 'full' or 'coarse'. `hull` is the (lons, lats)
+    the 'hull' mask is drawn round, by default the stations."""
+    mask = GRID_MASK if mask is None else mask
+    mode = GRID_ANALYSIS if mode is None else mode
+    max_error = GRID_COARSE_MAX_ERROR if max_error is None else max_error
+    if lat_arr is None:
+        lat_arr = np.linspace(lats.min(), lats.max(), GRID_SIZE)
+    if lon_arr is None:
+        lon_arr = np.linspace(lons.min(), lons.max(), GRID_SIZE)
+    tree = cKDTree(sphere_points(lons, lats))
+
+    if mode == 'coarse':
+        with timer('pipeline_stage_seconds', stage='grid_coarse'):
+            grid = coarse_analysis(tree, lons, lats, values, lon_arr, lat_arr, sigma, mask, max_error, hull)
+        if grid is not None:
+            return lon_arr, lat_arr, grid
+
+    with timer('pipeline_stage_seconds', stage='grid'):
+        grid, cells = interpolate_grid(tree, lons, lats, values, lon_arr, lat_arr, mask, hull=hull)
+    with timer('pipeline_stage_seconds', stage='smooth'):
+        grid = smooth_grid(grid, cells, sigma)
+    return lon_arr, lat_arr, grid
+
+def contour_levels(grid, step):
+    min_value = np.nanmin(grid)
+    max_value = np.nanmax(grid)
+    return np.arange(np.floor(min_value / step) * step, np.ceil(max_value / step) * step + step, step)
+
+def save_contours(lon_arr, lat_arr, grid, levels, output_file):
+    lat_grid, lon_grid = np.meshgrid(lat_arr, lon_arr)
+    with timer('pipeline_stage_seconds', stage='contour'):
+        contours = plt.contour(lon_grid, lat_grid, grid, levels=levels)
+    levels, allsegs = contours.levels, contours.allsegs
+    plt.close('all')
+    save_lines(levels, allsegs, output_file)
+
+def save_lines(levels, allsegs, output_file):
+    output_dir = os.path.dirname(output_file)
+    if output_dir and not os.path.exists(output_dir):
+        os.makedirs(output_dir)
+    with timer('pipeline_stage_seconds', stage='serialise'):
+        data = json.dumps(lines_to_geojson(levels, allsegs)).encode()
+        # A gzipped copy lets the app send the file without compressing it on every request
+        for path, content in ((output_file, data), (output_file + '.gz', gzip.compress(data, compresslevel=6, mtime=0))):
+            with open(path + '.tmp', 'wb') as f:
+                f.write(content)
+            os.replace(path + '.tmp', path)
+    print(f'GeoJSON saved to {output_file}')
+
+# Grids are stored as raw .npy arrays with a small JSON sidecar so every
+# gunicorn worker can memory-map the same file instead of holding a copy.
+def grid_path(timestamp, name):
+    return os.path.join(GRID_DIR, f'{timestamp}_{name}.npy')
+
+def grid_meta_path(timestamp, name):
+    return os.path.join(GRID_DIR, f'{timestamp}_{name}.json')
+
+def save_grid(timestamp, name, lon_arr, lat_arr, grid):
+    os.makedirs(GRID_DIR, exist_ok=True)
+    grid = np.ascontiguousarray(grid, dtype=np.float32)
+    meta = {
+        'timestamp': str(timestamp),
+        'field': name,
+        'lon_min': float(lon_arr[0]),
+        'lon_max': float(lon_arr[-1]),
+        'lat_min': float(lat_arr[0]),
+        'lat_max': float(lat_arr[-1]),
+        'shape': list(grid.shape),
+        'dtype': str(grid.dtype),
+    }
+    path = grid_path(timestamp, name)
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    with open(tmp_path, 'wb') as f:
+        np.save(f, grid)
+    os.replace(tmp_path, path)
+    meta_path = grid_meta_path(timestamp, name)
+    tmp_path = f'{meta_path}.{os.getpid()}.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(meta, f)
+    os.replace(tmp_path, meta_path)
+
+def load_grid_meta(timestamp, name):
+    meta_path = grid_meta_path(timestamp, name)
+    if not os.path.exists(meta_path) or not os.path.exists(grid_path(timestamp, name)):
+        return None
+    with open(meta_path, 'r') as f:
+        return json.load(f)
+
+def load_grid(timestamp, name):
+    """Return a cached (lon_arr, lat_arr, grid) or None; grid is a read-only memmap."""
+    meta = load_grid_meta(timestamp, name)
+    if meta is None:
+        return None
+    grid = np.load(grid_path(timestamp, name), mmap_mode='r')
+    lon_arr = np.linspace(meta['lon_min'], meta['lon_max'], meta['shape'][0])
+    lat_arr = np.linspace(meta['lat_min'], meta['lat_max'], meta['shape'][1])
+    return lon_arr, lat_arr, grid
+
+def sample_points(timestamp, name, lats, lons):
+    """Bilinear values of a cached grid at the given points, NaN outside it. None if the grid is missing.
+
+    Only the four cells around each point are read from the memmap."""
+    cached = load_grid(timestamp, name)
+    if cached is None:
+        return None
+    lon_arr, lat_arr, grid = cached
+    lats = np.atleast_1d(np.asarray(lats, dtype=float))
+    lons = np.atleast_1d(np.asarray(lons, dtype=float))
+    nlon, nlat = grid.shape
+
+    fi = (lons - lon_arr[0]) / (lon_arr[-1] - lon_arr[0]) * (nlon - 1)
+    fj = (lats - lat_arr[0]) / (lat_arr[-1] - lat_arr[0]) * (nlat - 1)
+    inside = (fi >= 0) & (fi <= nlon - 1) & (fj >= 0) & (fj <= nlat - 1)
+    i0 = np.clip(np.floor(np.nan_to_num(fi)).astype(int), 0, nlon - 2)
+    j0 = np.clip(np.floor(np.nan_to_num(fj)).astype(int), 0, nlat - 2)
+    wi = np.clip(fi - i0, 0, 1)
+    wj = np.clip(fj - j0, 0, 1)
+    values = (grid[i0, j0] * (1 - wi) * (1 - wj) + grid[i0 + 1, j0] * wi * (1 - wj)
+              + grid[i0, j0 + 1] * (1 - wi) * wj + grid[i0 + 1, j0 + 1] * wi * wj)
+    return np.where(inside, values, np.nan)
+
+# 'box' grids the stations' lat/lon rectangle in one go; 'tiled' splits a
+# fixed-resolution lattice into tiles analysed in parallel (python/domain.py).
+GRID_DOMAIN = os.environ.get('GRID_DOMAIN', 'box')
+
 def generate_geojson(timestamp):
     data=read_data(timestamp)
     data = data.drop_duplicates(subset='station_id')
@@ -74,29 +399,40 @@ def generate_geojson(timestamp):
     valid_lons = lons[valid_indices1]
     valid_pressure = pressure[valid_indices1].astype(float)
 
-    lat_arr = np.linspace(valid_lats.min(), valid_lats.max(), 1000)
-    lon_arr = np.linspace(valid_lons.min(), valid_lons.max(), 1000)
-    lat_grid, lon_grid = np.meshgrid(lat_arr, lon_arr)
-    lat_grid_flat, lon_grid_flat = lat_grid.flatten(), lon_grid.flatten()
+    output_file = os.path.join('contours_data', f'{timestamp}.geojson')
+    if GRID_DOMAIN == 'tiled':
+        from python.domain import lattice, tiled_analysis
+        lon_arr, lat_arr, pressure_grid, levels, allsegs = tiled_analysis(
+            valid_lons, valid_lats, valid_pressure, lattice(lons, lats), step=2)
+        save_grid(timestamp, 'pressure_sea_level', lon_arr, lat_arr, pressure_grid)
+        save_lines(levels, allsegs, output_file)
+        return
 
-    pressure_grid_flat = idw_interpolation(valid_lons, valid_lats, valid_pressure, lon_grid_flat, lat_grid_flat)
-    pressure_grid = pressure_grid_flat.reshape(lat_grid.shape)
-    
-    pressure_grid = sp.ndimage.gaussian_filter(pressure_grid, sigma=5)
-    min_pressure = np.nanmin(pressure_grid)
-    max_pressure = np.nanmax(pressure_grid)
-    levels = np.arange(np.floor(min_pressure / 2) * 2, np.ceil(max_pressure / 2) * 2 + 2, 2)
-    
-    # Create contours
-    contours = plt.contour(lon_grid, lat_grid, pressure_grid, levels=levels)
-    output_dir = 'contours_data'
-    if not os.path.exists(output_dir):
-        os.makedirs(output_dir)
-    contour_geojson = contours_to_geojson(contours)
-    output_file = os.path.join(output_dir, f'{timestamp}.geojson')
-    with open(output_file, 'w') as f:
-        json.dump(contour_geojson, f)
-    print(f'GeoJSON saved to {output_file}')
+    lon_arr, lat_arr, pressure_grid = analysis_grid(valid_lons, valid_lats, valid_pressure)
+    save_grid(timestamp, 'pressure_sea_level', lon_arr, lat_arr, pressure_grid)
+    levels = contour_levels(pressure_grid, 2)
+    save_contours(lon_arr, lat_arr, pressure_grid, levels, output_file)
+
+GRID_FIELDS = ['air_temp', 'dew_point']
+
+def generate_field_grids(timestamp, fields=GRID_FIELDS):
+    """Grid extra fields on the same domain as the cycle's pressure analysis."""
+    data=read_data(timestamp)
+    data = data.drop_duplicates(subset='station_id')
+    lats = data['Latitude'].values
+    lons = data['Longitude'].values
+    base = load_grid(timestamp, 'pressure_sea_level')
+    lon_arr, lat_arr = (base[0], base[1]) if base is not None else (None, None)
+    for field in fields:
+        values = data[field].values.astype(float)
+        valid = ~np.isnan(values)
+        if GRID_DOMAIN == 'tiled':
+            from python.domain import lattice, tiled_analysis
+            field_lon_arr, field_lat_arr, grid, _, _ = tiled_analysis(lons[valid], lats[valid], values[valid], lattice(lons, lats))
+        else:
+            field_lon_arr, field_lat_arr, grid = analysis_grid(lons[valid], lats[valid], values[valid], lon_arr, lat_arr)
+        save_grid(timestamp, field, field_lon_arr, field_lat_arr, grid)
+        print(f'Grid for {field} saved to {grid_path(timestamp, field)}')
 
 def generate_geojson_diff_four(timestamp):
     data=read_data(timestamp)
@@ -1,9 +1,12 @@
-import os,math
+import os,math,csv,heapq,pickle,hashlib,tempfile
 from pymetdecoder import synop as s
 import pandas as pd
 import warnings
 import sys
 import os
+from python.timeseries import TIMESERIES_FIELDS, append_cycle
+from python.fast_synop import FIELDS, decode_lines
+from python.metrics import inc, timer
 # Suppress all warnings globally
 warnings.simplefilter("ignore")
 
@@ -13,6 +16,24 @@ sys.stderr = open(os.devnull, 'w')
 # Constants
 STATION_TYPE = "AAXX"
 DEFAULT_WIND_INDICATOR = "4"
+STATION_DETAILS_COLUMNS = ['Country', 'Region', 'Place_Name', 'Station_Name', 'WMO', 'Latitude', 'Longitude', 'Elevation']
+
+# How a bulletin becomes its CSV. 'batch' decodes every line into one
+# DataFrame and sorts it by Country before writing. 'stream' reads the
+# bulletin line by line and decodes DECODE_CHUNK_ROWS lines at a time into
+# column buffers allocated once; each chunk is ordered by the Country rank
+# precomputed from the station list and spilled as a sorted run, and the
+# runs are merged into the CSV. Memory then follows the chunk size and the
+# station list rather than the bulletin, apart from 16-byte digests of the
+# distinct lines. Both modes write the same bytes: batch sorts stably, so
+# rows of a country keep their bulletin order, and stream keeps the decoded
+# values in its runs and formats each column at merge time the way pandas
+# writes the dtype the column's values add up to over the whole bulletin.
+DECODE_MODES = ('batch', 'stream')
+DECODE_MODE = os.environ.get('DECODE_MODE', 'batch')
+DECODE_CHUNK_ROWS = int(os.environ.get('DECODE_CHUNK_ROWS', 2000))
+
+_station_orders = {}  # station list path -> (mtime, order)
 
 # Function to decode SYNOP data
 def decode_synop_data(synop_string):
@@ -22,6 +43,7 @@ def decode_synop_data(synop_string):
             raise ValueError("Decoding returned None")
         return decoded_synop
     except Exception as e:
+        inc('synop_decode_failures_total')
         print(f"Error decoding SYNOP data: {e}")
         return {}
 
@@ -464,22 +486,254 @@ def process_evapotranspiration(decoded_synop):
 # File paths
 station_codes_file = "E:/WMO/WMO_stations_data.csv"
 
-def process_synop_files(station_codes_file, directory, output_directory,timestamp):
-    # Read the CSV file
+def process_synop_files(station_codes_file, directory, output_directory,timestamp, mode=None):
+    mode = mode or DECODE_MODE
+    if mode not in DECODE_MODES:
+        raise ValueError(f"DECODE_MODE must be one of {DECODE_MODES}, not {mode!r}")
+    with timer('pipeline_stage_seconds', stage='decode'):
+        _process_synop_files(station_codes_file, directory, output_directory, timestamp, mode)
+
+def decoded_fields(decoded_synop, time_str):
+    """Row values for one decoded SYNOP report."""
+    temperature = process_all_temperatures(decoded_synop)
+    wind_indicator, wind_indicator_unit = process_wind_indicator(decoded_synop)
+    wind_speed, wind_speed_unit = process_wind_speed(decoded_synop)
+    wind_direction, wind_direction_unit = process_wind_direction(decoded_synop)
+    pressure_sea_level, pressure_sea_level_unit = process_pressure_sea_level(decoded_synop)
+    pressure_station_level, pressure_station_level_unit = process_pressure_station_level(decoded_synop)
+    visibility, visibility_unit = process_visibility(decoded_synop)
+    cloud_cover, cloud_cover_unit = process_cloud_cover(decoded_synop)
+    pressure_change, pressure_change_unit = process_pressure_change(decoded_synop)
+    tendency = process_pressure_tendency(decoded_synop)
+    geopotential, geopotential_unit = process_geopotential(decoded_synop)
+    height, height_unit = process_height(decoded_synop)
+    precipitation3H, precipitation6H, precipitation9H, precipitation12H, precipitation15H, precipitation18H, precipitation_unit = process_complete_precipitation(decoded_synop)
+    precipitation24H = process_precipitation_24h(decoded_synop)
+    lowest_cloud_min, lowest_cloud_max, lowest_cloud_unit = process_lowest_cloud_base(decoded_synop)
+    present_weather_value, TBO, TBO_unit = process_present_weather(decoded_synop)
+    cloud_type, cloud_amount, cloud_amount_unit = process_cloud_types(decoded_synop)
+    low_cloud_direction, mid_cloud_direction, high_cloud_direction = process_cloud_drift_direction(decoded_synop)
+
+    return {
+        'station_id': process_station_id(decoded_synop),
+        'observation_time': time_str,
+        'air_temp': temperature['air_temperature'][0],
+        'air_temp_unit': temperature['air_temperature'][1],
+        'dew_point': temperature['dewpoint_temperature'][0],
+        'dew_point_unit': temperature['dewpoint_temperature'][1],
+        'min_temp': temperature['minimum_temperature'][0],
+        'min_temp_unit': temperature['minimum_temperature'][1],
+        'max_temp': temperature['maximum_temperature'][0],
+        'max_temp_unit': temperature['maximum_temperature'][1],
+        'temp_change': temperature['temperature_change'][0],
+        'temp_change_unit': temperature['temperature_change'][1],
+        'wind_indicator': wind_indicator,
+        'wind_indicator_unit': wind_indicator_unit,
+        'wind_speed': wind_speed,
+        'wind_speed_unit': wind_speed_unit,
+        'wind_direction': wind_direction,
+        'wind_direction_unit': wind_direction_unit,
+        'pressure_sea_level': pressure_sea_level,
+        'pressure_sea_level_unit': pressure_sea_level_unit,
+        'pressure_station_level': pressure_station_level,
+        'pressure_station_level_unit': pressure_station_level_unit,
+        'pressure_change': pressure_change,
+        'pressure_change_unit': pressure_change_unit,
+        'tendency': tendency,
+        'geopotential': geopotential,
+        'geopotential_unit': geopotential_unit,
+        'height': height,
+        'height_unit': height_unit,
+        'precipitation_indicator': process_precipitation_indicator(decoded_synop),
+        'precipitation3H': precipitation3H,
+        'precipitation6H': precipitation6H,
+        'precipitation9H': precipitation9H,
+        'precipitation12H': precipitation12H,
+        'precipitation15H': precipitation15H,
+        'precipitation18H': precipitation18H,
+        'precipitation24H': precipitation24H,
+        'precipitation_unit': precipitation_unit,
+        'min_lowest_cloud_base': lowest_cloud_min,
+        'max_lowest_cloud_base': lowest_cloud_max,
+        'lowest_cloud_base_unit': lowest_cloud_unit,
+        'visibility': visibility,
+        'visibility_unit': visibility_unit,
+        'cloud_cover': cloud_cover,
+        'cloud_cover_unit': cloud_cover_unit,
+        'cloud_type': cloud_type,
+        'cloud_amount': cloud_amount,
+        'cloud_amount_unit': cloud_amount_unit,
+        'weather_phenomena': process_weather_indicator(decoded_synop),
+        'present_weather': present_weather_value,
+        'TBO': TBO,
+        'TBO_unit': TBO_unit,
+        'past_weather': process_past_weather(decoded_synop),
+        'low_cloud_direction': low_cloud_direction,
+        'mid_cloud_direction': mid_cloud_direction,
+        'high_cloud_direction': high_cloud_direction,
+    }
+
+
+def decode_chunk(lines, time_str, columns=None):
+    """Decode station lines into FIELDS columns, the fast parser first and
+    pymetdecoder for the lines it can't handle."""
+    with timer('synop_decode_seconds', parser='fast'):
+        columns, fallback = decode_lines(lines, time_str, columns)
+    for position in fallback:
+        with timer('synop_decode_line_seconds'):
+            decoded_synop = decode_synop_data(f"{STATION_TYPE} {time_str} {lines[position]}")
+        for field, value in decoded_fields(decoded_synop, time_str).items():
+            columns[field][position] = value
+    inc('synop_lines_decoded_total', len(lines))
+    inc('synop_fallback_lines_total', len(fallback))
+    return columns
+
+def batch_synop_file(station_codes_file, file_path, output_path, time_str):
+    """Decode a whole bulletin into one DataFrame, sort it by Country and write it."""
     df = pd.read_csv(station_codes_file)
     wmo_codes = set(df['WMO'].astype(int).astype(str))
-    station_details_columns = ['Country', 'Region', 'Place_Name', 'Station_Name', 'WMO', 'Latitude', 'Longitude', 'Elevation']
-
-    decoded_fieldnames = [
-        'station_id','observation_time', 'air_temp','air_temp_unit', 'dew_point','dew_point_unit', 'min_temp','min_temp_unit','max_temp','max_temp_unit','temp_change','temp_change_unit'
-        'wind_indicator','wind_indicator_unit', 'wind_speed','wind_speed_unit', 'wind_direction','wind_direction_unit', 'pressure_sea_level','pressure_sea_level_unit',
-        'pressure_station_level','pressure_station_level_unit'
-        'pressure_change','pressure_change_unit','tendency', 'geopotential','geopotential_unit', 'height','height_unit','precipitation_indicator', 'precipitation3H','precipitation3H_unit','precipitation6H','precipitation6H_unit',
-        'precipitation12H','precipitation12H_unit', 'precipitation18H','precipitation18H_unit', 'precipitation24H','precipitation24H_unit',
-        'min_lowest_cloud_base','max_lowest_cloud_base','lowest_cloud_base_unit', 'visibility','visibility_unit', 'cloud_cover','cloud_cover_unit', 'cloud_type','cloud_amount','cloud_amount_unit', 'weather_phenomena', 'present_weather','TBO','TBO_unit',
-        'past_weather','low_cloud_direction','mid_cloud_direction','high_cloud_direction'
-    ]
-
+    station_lines = []
+    unique_synop_strings = set()
+
+    with open(file_path, 'r') as file:
+        # Read and filter lines from the current file
+        lines = [line.strip() for line in file if line.strip()]
+        for line in lines:
+            parts = line.split()
+            if parts and parts[0] in wmo_codes:
+                # Create the SYNOP string
+                synop_string = f"{STATION_TYPE} {time_str} {line}"
+                if synop_string not in unique_synop_strings:
+                    unique_synop_strings.add(synop_string)
+                    station_lines.append(line)
+
+    columns = decode_chunk(station_lines, time_str)
+
+    # First row of the station list for every decoded station
+    station_rows = {}
+    for position, code in enumerate(df['WMO'].astype(int)):
+        station_rows.setdefault(code, position)
+    rows = [station_rows[int(line.split()[0])] for line in station_lines]
+    station_details = df.iloc[rows][STATION_DETAILS_COLUMNS].reset_index(drop=True)
+
+    output_df = pd.concat([station_details, pd.DataFrame(columns)], axis=1).sort_values(by=['Country'], kind='stable')
+    output_df.to_csv(output_path, index=False, columns=output_df.columns)
+    return output_df
+
+def station_order(station_codes_file):
+    """WMO code -> (Country rank, STATION_DETAILS_COLUMNS values) from the first
+    row of every station in the list, cached until the file changes. Ranks
+    follow the sorted country names, with stations without one last."""
+    mtime = os.path.getmtime(station_codes_file)
+    cached = _station_orders.get(station_codes_file)
+    if cached is None or cached[0] != mtime:
+        df = pd.read_csv(station_codes_file)
+        ranks = {country: rank for rank, country in enumerate(sorted(set(df['Country'].dropna())))}
+        details = zip(*[[None if isinstance(value, float) and math.isnan(value) else value for value in df[column].tolist()]
+                        for column in STATION_DETAILS_COLUMNS])
+        order = {}
+        for code, row in zip(df['WMO'].astype(int).astype(str), details):
+            if code not in order:
+                order[code] = (ranks.get(row[0], len(ranks)), list(row))
+        cached = (mtime, order)
+        _station_orders[station_codes_file] = cached
+    return cached[1]
+
+def write_run(path, lines, columns, order):
+    """Pickle decoded chunk rows as (Country rank, values) records, ordered by rank."""
+    codes = [line.split(None, 1)[0] for line in lines]
+    buffers = [columns[field] for field in FIELDS]
+    with open(path, 'wb') as f:
+        for position in sorted(range(len(lines)), key=lambda position: order[codes[position]][0]):
+            rank, details = order[codes[position]]
+            pickle.dump((rank, details + [buffer[position] for buffer in buffers]), f, pickle.HIGHEST_PROTOCOL)
+
+def read_run(path):
+    with open(path, 'rb') as f:
+        while True:
+            try:
+                yield pickle.load(f)
+            except EOFError:
+                return
+
+def _as_float(value):
+    return None if value is None or value != value else float(value)
+
+def _as_object(value):
+    return None if isinstance(value, float) and value != value else value
+
+def column_converter(types):
+    """What to apply to the values of a column holding these types so the csv
+    module writes them as pandas writes the column's dtype; None for nothing."""
+    values = types - {type(None)}
+    if not values or types == {int}:
+        return None
+    if values <= {int, float}:
+        # float64: integers get a decimal point and missing values are empty
+        return _as_float
+    return _as_object if float in values else None
+
+def stream_synop_file(station_codes_file, file_path, output_path, time_str, chunk_rows=None):
+    """Decode a bulletin chunk by chunk into sorted runs and merge them into the
+    CSV. Returns the time series columns of each station's first report."""
+    chunk_rows = chunk_rows or DECODE_CHUNK_ROWS
+    order = station_order(station_codes_file)
+    columns = {field: [None] * chunk_rows for field in FIELDS}
+    types = {field: set() for field in FIELDS}
+    timeseries_columns = ['station_id'] + TIMESERIES_FIELDS
+    first_reports = {}
+    seen = set()
+    lines = []
+    runs = []
+
+    with tempfile.TemporaryDirectory(prefix='decode-runs-', dir=os.path.dirname(output_path) or '.') as run_dir:
+        def flush():
+            decode_chunk(lines, time_str, columns)
+            path = os.path.join(run_dir, f'{len(runs)}.pkl')
+            write_run(path, lines, columns, order)
+            runs.append(path)
+            for field in FIELDS:
+                types[field].update(map(type, columns[field][:len(lines)]))
+            for position, line in enumerate(lines):
+                station_id = columns['station_id'][position]
+                if station_id is not None and station_id not in first_reports:
+                    details = order[line.split(None, 1)[0]][1]
+                    first_reports[station_id] = [columns[field][position] for field in timeseries_columns] + details[2:4] + details[5:7]
+            lines.clear()
+
+        with open(file_path, 'r') as file:
+            for line in file:
+                line = line.strip()
+                if not line or line.split(None, 1)[0] not in order:
+                    continue
+                digest = hashlib.blake2b(line.encode(), digest_size=16).digest()
+                if digest in seen:
+                    continue
+                seen.add(digest)
+                lines.append(line)
+                if len(lines) == chunk_rows:
+                    flush()
+        if lines:
+            flush()
+
+        offset = len(STATION_DETAILS_COLUMNS)
+        converters = [(offset + i, converter) for i, converter in
+                      enumerate(column_converter(types[field]) for field in FIELDS) if converter is not None]
+        tmp_path = output_path + '.tmp'
+        with open(tmp_path, 'w', newline='') as out:
+            writer = csv.writer(out, lineterminator='\n')
+            writer.writerow(STATION_DETAILS_COLUMNS + FIELDS)
+            # heapq.merge keeps equal ranks in run order, so in bulletin order
+            for _, row in heapq.merge(*[read_run(path) for path in runs], key=lambda record: record[0]):
+                for i, converter in converters:
+                    row[i] = converter(row[i])
+                writer.writerow(row)
+        os.replace(tmp_path, output_path)
+
+    return pd.DataFrame(list(first_reports.values()),
+                        columns=timeseries_columns + ['Place_Name', 'Station_Name', 'Latitude', 'Longitude'])
+
+def _process_synop_files(station_codes_file, directory, output_directory,timestamp, mode):
     # Ensure the output directory exists
     os.makedirs(output_directory, exist_ok=True)
 
@@ -494,111 +748,12 @@ def process_synop_files(station_codes_file, directory, output_directory,timestam
             time_str = filename.split('.')[0][6:10] + DEFAULT_WIND_INDICATOR
             output_filename = filename.replace("syn", "").replace(".txt", ".csv")
             output_path = os.path.join(output_directory, output_filename)
-            output_data = []  
-            unique_synop_strings = set()
-
-            with open(file_path, 'r') as file:
-                # Read and filter lines from the current file
-                lines = [line.strip() for line in file if line.strip()]
-                for line in lines:
-                    parts = line.split()
-                    if parts and parts[0] in wmo_codes:
-                        # Create the SYNOP string
-                        synop_string = f"{STATION_TYPE} {time_str} {line}"
-                        station_data = df[df['WMO'] == int(parts[0])]
-
-                        if synop_string not in unique_synop_strings:
-                            unique_synop_strings.add(synop_string)
-
-                            # Decode the SYNOP string
-                            decoded_synop = decode_synop_data(synop_string)
-
-                            temperature = process_all_temperatures(decoded_synop)
-                            wind_indicator, wind_indicator_unit = process_wind_indicator(decoded_synop)
-                            wind_speed, wind_speed_unit = process_wind_speed(decoded_synop)
-                            wind_direction, wind_direction_unit = process_wind_direction(decoded_synop)
-                            pressure_sea_level, pressure_sea_level_unit = process_pressure_sea_level(decoded_synop)
-                            pressure_station_level, pressure_station_level_unit = process_pressure_station_level(decoded_synop)
-                            visibility, visibility_unit = process_visibility(decoded_synop)
-                            cloud_cover, cloud_cover_unit = process_cloud_cover(decoded_synop)
-                            pressure_change, pressure_change_unit = process_pressure_change(decoded_synop)
-                            tendency = process_pressure_tendency(decoded_synop)
-                            geopotential, geopotential_unit = process_geopotential(decoded_synop)
-                            height, height_unit = process_height(decoded_synop)
-                            precipitation3H, precipitation6H, precipitation9H, precipitation12H, precipitation15H, precipitation18H, precipitation_unit = process_complete_precipitation(decoded_synop)
-                            precipitation24H = process_precipitation_24h(decoded_synop)
-                            lowest_cloud_min, lowest_cloud_max, lowest_cloud_unit = process_lowest_cloud_base(decoded_synop)
-                            present_weather_value, TBO, TBO_unit = process_present_weather(decoded_synop)
-                            cloud_type, cloud_amount, cloud_amount_unit = process_cloud_types(decoded_synop)
-                            low_cloud_direction, mid_cloud_direction, high_cloud_direction = process_cloud_drift_direction(decoded_synop)
-
-                            decoded_data = {
-                                'station_id': process_station_id(decoded_synop),
-                                'observation_time': time_str,
-                                'air_temp': temperature['air_temperature'][0],
-                                'air_temp_unit': temperature['air_temperature'][1],
-                                'dew_point': temperature['dewpoint_temperature'][0],
-                                'dew_point_unit': temperature['dewpoint_temperature'][1],
-                                'min_temp': temperature['minimum_temperature'][0],
-                                'min_temp_unit': temperature['minimum_temperature'][1],
-                                'max_temp': temperature['maximum_temperature'][0],
-                                'max_temp_unit': temperature['maximum_temperature'][1],
-                                'temp_change': temperature['temperature_change'][0],
-                                'temp_change_unit': temperature['temperature_change'][1],
-                                'wind_indicator': wind_indicator,
-                                'wind_indicator_unit': wind_indicator_unit,
-                                'wind_speed': wind_speed,
-                                'wind_speed_unit': wind_speed_unit,
-                                'wind_direction': wind_direction,
-                                'wind_direction_unit': wind_direction_unit,
-                                'pressure_sea_level': pressure_sea_level,
-                                'pressure_sea_level_unit': pressure_sea_level_unit,
-                                'pressure_station_level': pressure_station_level,
-                                'pressure_station_level_unit': pressure_station_level_unit,
-                                'pressure_change': pressure_change,
-                                'pressure_change_unit': pressure_change_unit,
-                                'tendency': tendency,
-                                'geopotential': geopotential,
-                                'geopotential_unit': geopotential_unit,
-                                'height': height,
-                                'height_unit': height_unit,
-                                'precipitation_indicator': process_precipitation_indicator(decoded_synop),
-                                'precipitation3H': precipitation3H,
-                                'precipitation6H': precipitation6H,
-                                'precipitation9H': precipitation9H,
-                                'precipitation12H': precipitation12H,
-                                'precipitation15H': precipitation15H,
-                                'precipitation18H': precipitation18H,
-                                'precipitation24H': precipitation24H,
-                                'precipitation_unit': precipitation_unit,
-                                'min_lowest_cloud_base': lowest_cloud_min,
-                                'max_lowest_cloud_base': lowest_cloud_max,
-                                'lowest_cloud_base_unit': lowest_cloud_unit,
-                                'visibility': visibility,
-                                'visibility_unit': visibility_unit,
-                                'cloud_cover': cloud_cover,
-                                'cloud_cover_unit': cloud_cover_unit,
-                                'cloud_type': cloud_type,
-                                'cloud_amount': cloud_amount,
-                                'cloud_amount_unit': cloud_amount_unit,
-                                'weather_phenomena': process_weather_indicator(decoded_synop),
-                                'present_weather': present_weather_value,
-                                'TBO': TBO,
-                                'TBO_unit': TBO_unit,
-                                'past_weather': process_past_weather(decoded_synop),
-                                'low_cloud_direction': low_cloud_direction,
-                                'mid_cloud_direction': mid_cloud_direction,
-                                'high_cloud_direction': high_cloud_direction,
-                            }
-                            station_details = station_data.iloc[0][station_details_columns].to_dict()
-
-                            combined_data = {**station_details, **decoded_data}
-                            
-                            output_data.append(combined_data)
-
-            output_df = pd.DataFrame(output_data).sort_values(by=['Country'])
-            output_df.to_csv(output_path, index=False, columns=output_df.columns)
+            if mode == 'stream':
+                output_df = stream_synop_file(station_codes_file, file_path, output_path, time_str)
+            else:
+                output_df = batch_synop_file(station_codes_file, file_path, output_path, time_str)
             print(f"Decoded data saved to {output_path}")   
+            append_cycle(timestamp, output_df)
 
         except Exception as e:
             print(f"Error processing file {filename}: {e}")
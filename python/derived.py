@@ -0,0 +1,104 @@
+import os
+import numpy as np
+from datetime import datetime, timedelta
+from python.contours import analysis_grid, contour_levels, save_contours, save_grid, load_grid, grid_path, sample_points
+from python.timeseries import load_station_index, station_coordinates, cycle_values
+
+# Change maps of a cycle against the one 3 or 24 hours earlier. They are the
+# difference of the two cycles' cached field grids, or where one of those is
+# missing an analysis of the per-station differences.
+# name -> (decoded column, contour interval)
+CHANGE_FIELDS = {
+    'pressure': ('pressure_sea_level', 1),
+    'temperature': ('air_temp', 2),
+}
+CHANGE_HOURS = (3, 24)
+MIN_STATIONS = 10
+
+
+def previous_timestamp(timestamp, hours):
+    previous = datetime.strptime(str(timestamp), "%Y%m%d%H") - timedelta(hours=hours)
+    return previous.strftime("%Y%m%d%H")
+
+def change_geojson_path(timestamp, name, hours):
+    return os.path.join('contours_data', f'{timestamp}_{name}_{hours}h.geojson')
+
+def station_changes(timestamp, hours, index):
+    """Per-station differences between a cycle and the one `hours` earlier, aligned on station_id."""
+    fields = [column for column, _ in CHANGE_FIELDS.values()]
+    current = cycle_values(timestamp, fields, index)
+    previous = cycle_values(previous_timestamp(timestamp, hours), fields, index)
+    return {column: current[column] - previous[column] for column in fields}
+
+def grid_change(timestamp, name, hours):
+    """Current minus earlier cached field grid on the current cycle's domain, or None if either grid is missing.
+
+    The earlier grid is sampled bilinearly where the two domains differ."""
+    column, _ = CHANGE_FIELDS[name]
+    current = load_grid(timestamp, column)
+    if current is None:
+        return None
+    previous = previous_timestamp(timestamp, hours)
+    earlier = load_grid(previous, column)
+    if earlier is None:
+        return None
+    lon_arr, lat_arr, grid = current
+    if np.array_equal(earlier[0], lon_arr) and np.array_equal(earlier[1], lat_arr):
+        earlier_grid = earlier[2]
+    else:
+        lon_mesh, lat_mesh = np.meshgrid(lon_arr, lat_arr, indexing='ij')
+        earlier_grid = sample_points(previous, column, lat_mesh.ravel(), lon_mesh.ravel()).reshape(grid.shape)
+    change = np.asarray(grid, dtype=float) - earlier_grid
+    if np.isnan(change).all():
+        return None
+    return lon_arr, lat_arr, change
+
+def change_grid(timestamp, name, hours, lats, lons, changes):
+    """Change grid of a field, from the cache, the cycles' field grids or the station differences `changes()` returns."""
+    # python.catalog imports this module for CHANGE_FIELDS
+    from python.catalog import is_current
+    grid_name = f'{name}_{hours}h'
+    # A grid cached before either cycle was last published is from replaced data
+    if is_current(grid_path(timestamp, grid_name), timestamp, previous_timestamp(timestamp, hours)):
+        cached = load_grid(timestamp, grid_name)
+        if cached is not None:
+            return cached
+
+    result = grid_change(timestamp, name, hours)
+    if result is not None:
+        save_grid(timestamp, grid_name, *result)
+        return result
+
+    column, _ = CHANGE_FIELDS[name]
+    changes = changes()
+    valid = ~np.isnan(changes[column]) & ~np.isnan(lats)
+    if valid.sum() < MIN_STATIONS:
+        print(f"Not enough stations for {grid_name} change at {timestamp}")
+        return None
+
+    # Grid on the same domain as the cycle's pressure analysis so the layers line up
+    base = load_grid(timestamp, 'pressure_sea_level')
+    lon_arr, lat_arr = (base[0], base[1]) if base is not None else (None, None)
+    lon_arr, lat_arr, grid = analysis_grid(lons[valid], lats[valid], changes[column][valid], lon_arr, lat_arr)
+    save_grid(timestamp, grid_name, lon_arr, lat_arr, grid)
+    return lon_arr, lat_arr, grid
+
+def generate_change_fields(timestamp):
+    index = load_station_index()
+    if not index:
+        print("Station index is empty, skipping change fields")
+        return
+    lats, lons = station_coordinates(index)
+    for hours in CHANGE_HOURS:
+        # Station differences are only read if a field grid of either cycle is missing
+        computed = {}
+        def changes(hours=hours):
+            if not computed:
+                computed.update(station_changes(timestamp, hours, index))
+            return computed
+        for name, (_, step) in CHANGE_FIELDS.items():
+            result = change_grid(timestamp, name, hours, lats, lons, changes)
+            if result is None:
+                continue
+            lon_arr, lat_arr, grid = result
+            save_contours(lon_arr, lat_arr, grid, contour_levels(grid, step), change_geojson_path(timestamp, name, hours))
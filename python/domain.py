@@ -0,0 +1,210 @@
+import os
+import numpy as np
+import matplotlib.pyplot as plt
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from python import contours
+from python.metrics import timer
+
+# Tiled analysis for large or global station sets. The domain is a lattice
+# with a fixed step in degrees, split into TILE_CELLS x TILE_CELLS tiles.
+# Each tile is gridded with a halo as wide as the smoothing filter, so its
+# interior is what one analysis of the whole lattice would give, and is
+# contoured one row and column past its interior so the lines of
+# neighbouring tiles end at the same points on the shared edge, where they
+# are stitched together. A lattice that goes all the way round wraps in
+# longitude. Station distances are taken on the sphere (python/contours.py),
+# so they are right across the dateline and near the poles; the stations
+# are only repeated a turn east and west to pick tiles and draw the hull
+# mask. The smoothing, and so the halo, is still a number of lattice cells.
+GRID_RESOLUTION = float(os.environ.get('GRID_RESOLUTION', 0.075))
+TILE_CELLS = int(os.environ.get('GRID_TILE_CELLS', 256))
+GRID_WORKERS = int(os.environ.get('GRID_WORKERS', 0)) or None
+SIGMA = 5
+HALO = int(4 * SIGMA + 0.5) + 1  # gaussian_filter's truncation plus the contour overlap
+
+
+def lattice(lons, lats, resolution=GRID_RESOLUTION):
+    """Lattice covering the stations.
+
+    Longitudes start after the widest gap between stations, so a set that
+    crosses the dateline is not stretched round the globe. If that gap is
+    narrower than a tile the lattice covers every longitude and wraps."""
+    order = np.sort(np.mod(lons + 180.0, 360.0) - 180.0)
+    gaps = np.diff(np.r_[order, order[0] + 360.0])
+    widest = np.argmax(gaps)
+    lat0 = np.floor(lats.min() / resolution) * resolution
+    nlat = int(np.ceil((lats.max() - lat0) / resolution)) + 1
+    if gaps[widest] < TILE_CELLS * resolution:
+        nlon = int(round(360.0 / resolution))
+        return {'lon0': -180.0, 'lon_step': 360.0 / nlon, 'nlon': nlon,
+                'lat0': lat0, 'lat_step': resolution, 'nlat': nlat, 'periodic': True}
+    start = order[(widest + 1) % len(order)]
+    end = start + 360.0 - gaps[widest]
+    lon0 = np.floor(start / resolution) * resolution
+    nlon = int(np.ceil((end - lon0) / resolution)) + 1
+    return {'lon0': lon0, 'lon_step': resolution, 'nlon': nlon,
+            'lat0': lat0, 'lat_step': resolution, 'nlat': nlat, 'periodic': False}
+
+def lattice_lons(lattice, start, stop):
+    """Longitudes of columns start..stop-1. Past the last column of a wrapping
+    lattice the first columns come round again, 360 degrees further east."""
+    i = np.arange(start, stop)
+    n = lattice['nlon']
+    if lattice['periodic']:
+        return lattice['lon0'] + np.mod(i, n) * lattice['lon_step'] + 360.0 * np.floor_divide(i, n)
+    return lattice['lon0'] + i * lattice['lon_step']
+
+def lattice_lats(lattice, start, stop):
+    return lattice['lat0'] + np.arange(start, stop) * lattice['lat_step']
+
+def unwrap_stations(lattice, lons, lats, values):
+    """Stations in the lattice's longitudes, plus copies a turn east and west if it wraps.
+
+    The copies are for planar tests in lon/lat only; a distance query would find each station three times."""
+    lons = lattice['lon0'] + np.mod(lons - lattice['lon0'], 360.0)
+    if not lattice['periodic']:
+        return lons, lats, values
+    return (np.r_[lons, lons - 360.0, lons + 360.0], np.r_[lats, lats, lats], np.r_[values, values, values])
+
+def tile_jobs(lattice, lons, lats, mask, levels):
+    """(i0, i1, j0, j1, levels) for every tile, skipping tiles a mask would leave empty."""
+    jobs = []
+    for i0 in range(0, lattice['nlon'], TILE_CELLS):
+        i1 = min(i0 + TILE_CELLS, lattice['nlon'])
+        for j0 in range(0, lattice['nlat'], TILE_CELLS):
+            j1 = min(j0 + TILE_CELLS, lattice['nlat'])
+            if mask != 'none':
+                tile_lons, tile_lats = lattice_lons(lattice, i0, i1), lattice_lats(lattice, j0, j1)
+                reach = contours.GRID_MASK_DEGREES
+                # An arc of `reach` spans more degrees of longitude away from the equator
+                polar = min(max(abs(tile_lats[0]), abs(tile_lats[-1])) + reach, 90.0)
+                lon_reach = reach / np.cos(np.radians(polar)) if polar < 90.0 else 360.0
+                near = ((lons >= tile_lons[0] - lon_reach) & (lons <= tile_lons[-1] + lon_reach)
+                        & (lats >= tile_lats[0] - reach) & (lats <= tile_lats[-1] + reach))
+                if not near.any():
+                    continue
+            jobs.append((i0, i1, j0, j1, levels))
+    return jobs
+
+_worker = {}
+
+def _init_worker(lattice, lons, lats, values, mask, hull):
+    _worker.update(lattice=lattice, lons=lons, lats=lats, values=values, mask=mask, hull=hull)
+
+def _analyse_tile(job):
+    """Interior block of one tile and, per level, the lines contoured over it."""
+    i0, i1, j0, j1, levels = job
+    lattice = _worker['lattice']
+    nlon, nlat = lattice['nlon'], lattice['nlat']
+    if lattice['periodic']:
+        pi0, pi1 = i0 - HALO, i1 + HALO
+    else:
+        pi0, pi1 = max(i0 - HALO, 0), min(i1 + HALO, nlon)
+    pj0, pj1 = max(j0 - HALO, 0), min(j1 + HALO, nlat)
+    lon_arr, lat_arr = lattice_lons(lattice, pi0, pi1), lattice_lats(lattice, pj0, pj1)
+    _, _, grid = contours.analysis_grid(_worker['lons'], _worker['lats'], _worker['values'], lon_arr, lat_arr,
+                                        sigma=SIGMA, mask=_worker['mask'], mode='full', hull=_worker['hull'])
+    block = grid[i0 - pi0:i1 - pi0, j0 - pj0:j1 - pj0]
+    if levels is None:
+        return i0, j0, block, None
+
+    ci1 = i1 + 1 if lattice['periodic'] or i1 < nlon else i1
+    cj1 = min(j1 + 1, nlat)
+    region = grid[i0 - pi0:ci1 - pi0, j0 - pj0:cj1 - pj0]
+    allsegs = [[] for _ in levels]
+    if min(region.shape) >= 2 and not np.isnan(region).all():
+        lat_grid, lon_grid = np.meshgrid(lat_arr[j0 - pj0:cj1 - pj0], lon_arr[i0 - pi0:ci1 - pi0])
+        with timer('pipeline_stage_seconds', stage='contour'):
+            contour_set = plt.contour(lon_grid, lat_grid, region, levels=levels)
+        allsegs = [[seg for seg in segs if len(seg) >= 2] for segs in contour_set.allsegs]
+        plt.close('all')
+    return i0, j0, block, allsegs
+
+def point_key(point, period):
+    x = point[0] if period is None else round(point[0] % period, 6) % period
+    return (round(x, 6), round(point[1], 6))
+
+def stitch_lines(pieces, period=None):
+    """Join lines that end where another one starts. With a `period` the
+    longitudes are compared modulo it and each joined line is unwrapped."""
+    lines, open_pieces = [], []
+    for piece in pieces:
+        if point_key(piece[0], period) == point_key(piece[-1], period):
+            lines.append(piece)
+        else:
+            open_pieces.append(piece)
+    ends = defaultdict(list)
+    for index, piece in enumerate(open_pieces):
+        ends[point_key(piece[0], period)].append((index, True))
+        ends[point_key(piece[-1], period)].append((index, False))
+
+    def take(point):
+        for index, at_start in ends[point_key(point, period)]:
+            if not used[index]:
+                used[index] = True
+                return open_pieces[index], at_start
+        return None, None
+
+    used = [False] * len(open_pieces)
+    for index, piece in enumerate(open_pieces):
+        if used[index]:
+            continue
+        used[index] = True
+        chain = [piece]
+        while True:
+            following, at_start = take(chain[-1][-1])
+            if following is None:
+                break
+            chain.append((following if at_start else following[::-1])[1:])
+        while True:
+            preceding, at_start = take(chain[0][0])
+            if preceding is None:
+                break
+            chain.insert(0, (preceding[::-1] if at_start else preceding)[:-1])
+        lines.append(np.concatenate(chain))
+
+    if period is not None:
+        for line in lines:
+            line[:, 0] = np.unwrap(line[:, 0], period=period)
+    return lines
+
+def tiled_analysis(lons, lats, values, grid_lattice, step=None, mask=None, workers=GRID_WORKERS):
+    """Grid the stations tile by tile across worker processes and, with a
+    contour `step`, contour and stitch the tiles.
+
+    Returns lon_arr, lat_arr, grid, levels and the lines of each level."""
+    mask = contours.GRID_MASK if mask is None else mask
+    levels = None
+    if step is not None:
+        levels = np.arange(np.floor(values.min() / step) * step, np.ceil(values.max() / step) * step + step, step)
+    station_lons, station_lats, _ = unwrap_stations(grid_lattice, lons, lats, values)
+    jobs = tile_jobs(grid_lattice, station_lons, station_lats, mask, levels)
+    initargs = (grid_lattice, lons, lats, values, mask, (station_lons, station_lats))
+
+    grid = np.full((grid_lattice['nlon'], grid_lattice['nlat']), np.nan)
+    pieces = defaultdict(list)
+    if workers == 1:
+        _init_worker(*initargs)
+        results = map(_analyse_tile, jobs)
+    else:
+        executor = ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=initargs)
+        results = executor.map(_analyse_tile, jobs)
+    try:
+        for i0, j0, block, allsegs in results:
+            grid[i0:i0 + block.shape[0], j0:j0 + block.shape[1]] = block
+            for level, segs in enumerate(allsegs or []):
+                pieces[level].extend(segs)
+    finally:
+        if workers != 1:
+            executor.shutdown()
+    print(f"Analysed {len(jobs)} tiles")
+
+    lon_arr = lattice_lons(grid_lattice, 0, grid_lattice['nlon'])
+    lat_arr = lattice_lats(grid_lattice, 0, grid_lattice['nlat'])
+    if levels is None:
+        return lon_arr, lat_arr, grid, None, None
+    period = 360.0 if grid_lattice['periodic'] else None
+    with timer('pipeline_stage_seconds', stage='stitch'):
+        allsegs = [stitch_lines(pieces[level], period) for level in range(len(levels))]
+    return lon_arr, lat_arr, grid, levels, allsegs
@@ -0,0 +1,462 @@
+import re
+from pymetdecoder import synop as s
+from pymetdecoder.synop import observations as obs
+
+# Fast path for the SYNOP groups we render. It walks the groups the same way
+# pymetdecoder's SYNOP._decode does, but only keeps the values that end up in
+# the decoded CSV and writes them straight into per-column lists. Individual
+# group values are decoded by pymetdecoder's own observation classes and
+# memoised on the raw group text, so repeated codes cost a dict lookup.
+# Anything outside the handled subset (section 2, 444, 0xxxx in section 3,
+# groups pymetdecoder would reject) raises Unsupported and the caller falls
+# back to the full pymetdecoder decode for that line.
+
+FIELDS = [
+    'station_id', 'observation_time', 'air_temp', 'air_temp_unit', 'dew_point', 'dew_point_unit',
+    'min_temp', 'min_temp_unit', 'max_temp', 'max_temp_unit', 'temp_change', 'temp_change_unit',
+    'wind_indicator', 'wind_indicator_unit', 'wind_speed', 'wind_speed_unit', 'wind_direction', 'wind_direction_unit',
+    'pressure_sea_level', 'pressure_sea_level_unit', 'pressure_station_level', 'pressure_station_level_unit',
+    'pressure_change', 'pressure_change_unit', 'tendency', 'geopotential', 'geopotential_unit', 'height', 'height_unit',
+    'precipitation_indicator', 'precipitation3H', 'precipitation6H', 'precipitation9H', 'precipitation12H',
+    'precipitation15H', 'precipitation18H', 'precipitation24H', 'precipitation_unit',
+    'min_lowest_cloud_base', 'max_lowest_cloud_base', 'lowest_cloud_base_unit', 'visibility', 'visibility_unit',
+    'cloud_cover', 'cloud_cover_unit', 'cloud_type', 'cloud_amount', 'cloud_amount_unit', 'weather_phenomena',
+    'present_weather', 'TBO', 'TBO_unit', 'past_weather', 'low_cloud_direction', 'mid_cloud_direction', 'high_cloud_direction',
+]
+PRECIPITATION_HOURS = {3: 0, 6: 1, 9: 2, 12: 3, 15: 4, 18: 5}
+GROUND_STATE_REGIONS = ("II", "III", "IV", "VI")
+VALID_GROUP = re.compile(r"[\d/]{5}")
+STATION_GROUP = re.compile(r"\d{5}")
+WIND_SPEED_GROUP = re.compile(r"00\d{3}")
+
+
+class Unsupported(Exception):
+    pass
+
+_FAILED = object()
+_MISSING = object()
+_memo = {}
+
+DECODERS = {
+    'obs_time': lambda raw: obs.ObservationTime().decode(raw),
+    'wind_indicator': lambda raw: obs.WindIndicator().decode(raw),
+    'region': lambda raw: obs.Region().decode(raw),
+    'precipitation_indicator': lambda raw: obs.PrecipitationIndicator().decode(raw[0], country=raw[1]),
+    'weather_indicator': lambda raw: obs.WeatherIndicator().decode(raw),
+    'lowest_cloud_base': lambda raw: obs.LowestCloudBase().decode(raw),
+    'visibility': lambda raw: obs.Visibility().decode(raw),
+    'cloud_cover': lambda raw: obs.CloudCover().decode(raw),
+    'surface_wind': lambda raw: obs.SurfaceWind().decode(raw),
+    'temperature': lambda raw: obs.Temperature().decode(raw),
+    'relative_humidity': lambda raw: obs.RelativeHumidity().decode(raw),
+    'pressure': lambda raw: obs.Pressure().decode(raw),
+    'geopotential': lambda raw: obs.Geopotential().decode(raw),
+    'pressure_tendency': lambda raw: obs.PressureTendency().decode(raw),
+    'precipitation': lambda raw: obs.Precipitation().decode(raw),
+    'precipitation_24h': lambda raw: obs.Precipitation().decode(raw, tenths=True),
+    'present_weather': lambda raw: obs.Weather().decode(raw[0], time_before=time_before_obs(raw[1]), type="present"),
+    'past_weather': lambda raw: obs.Weather().decode(raw, type="past"),
+    'cloud_types': lambda raw: obs.CloudType().decode(raw),
+    'exact_obs_time': lambda raw: obs.ExactObservationTime().decode(raw),
+    'ground_state': lambda raw: obs.GroundState().decode(raw),
+    'ground_state_snow': lambda raw: obs.GroundStateSnow().decode(raw),
+    'evapotranspiration': lambda raw: obs.Evapotranspiration().decode(raw),
+    'temperature_change': lambda raw: obs.TemperatureChange().decode(raw),
+    'cloud_drift_direction': lambda raw: obs.CloudDriftDirection().decode(raw),
+    'cloud_elevation': lambda raw: obs.CloudElevation().decode(raw),
+    'pressure_change': lambda raw: obs.PressureChange().decode(raw),
+    'cloud_layer': lambda raw: obs.CloudLayer().decode(raw),
+    'sunshine': lambda raw: obs.Sunshine().decode(raw),
+    'radiation': lambda raw: obs.Radiation().decode(raw[0], unit=raw[1], time_before={"value": raw[2], "unit": "h"}),
+    'group_9': lambda raw: _check_group_9(*raw),
+}
+
+def _decode(kind, raw):
+    """pymetdecoder's value for one group, memoised. Raises Unsupported where pymetdecoder would fail."""
+    key = (kind, raw)
+    value = _memo.get(key, _MISSING)
+    if value is _MISSING:
+        try:
+            value = DECODERS[kind](raw)
+        except Exception:
+            value = _FAILED
+        _memo[key] = value
+    if value is _FAILED:
+        raise Unsupported(f"{kind} {raw}")
+    return value
+
+def _check_group_9(group_9, time_before, wind_code, present, past):
+    # Group 9 does not feed any column, but pymetdecoder rejects the whole
+    # report when it cannot parse it, so run its parser on the state it reads
+    wind_indicator = obs.WindIndicator().decode(wind_code)
+    data = {'wind_indicator': wind_indicator}
+    if present is not _MISSING:
+        data['present_weather'] = None if present is None else {'value': present}
+    if past is not _MISSING:
+        data['past_weather'] = [None if missing else {} for missing in past]
+    s.SYNOP()._parse_group_9(data, list(group_9), time_before_obs(time_before))
+    return True
+
+def _get(d, *keys):
+    # Same lookup as decoding.get_safe_value
+    for key in keys:
+        if not isinstance(d, dict):
+            return None
+        d = d.get(key, {})
+    if isinstance(d, (int, float)):
+        return d
+    if isinstance(d, str):
+        return d.strip()
+    return None
+
+def _valid(group):
+    return len(group) == 5 and VALID_GROUP.match(group) is not None
+
+def time_before_default(obs_time):
+    """Hours covered by present weather for the observation hour (regulations 12.2.6.6.1 and 12.2.6.7.1)."""
+    try:
+        hour = obs_time["hour"]["value"]
+    except Exception:
+        return None
+    if hour in [0, 6, 12, 18]:
+        return 6
+    if hour in [3, 9, 15, 21]:
+        return 3
+    return 1
+
+def time_before_obs(hours):
+    return None if hours is None else {"value": hours, "unit": "h"}
+
+def parse_groups(groups, time_str, header):
+    """Decoded column values for the groups after AAXX YYGGi, in FIELDS order."""
+    wind_code, wind_indicator, time_before = header
+    data = {}
+    group_9 = []
+    group_5 = None
+    msg_5 = []
+    groups = iter(groups)
+    try:
+        group = next(groups)
+        if not STATION_GROUP.fullmatch(group):
+            raise Unsupported(group)
+        data['station_id'] = group
+        region = _decode('region', group)["value"]
+        country = "RU" if 20000 <= int(group) <= 39999 else None
+
+        next_group = next(groups)
+        if next_group == "NIL":
+            return _row(data, time_str, wind_indicator)
+
+        ### Section 1 ###
+        precipitation_indicator = None
+        if _valid(next_group):
+            precipitation_indicator = _decode('precipitation_indicator', (next_group[0:1], country))
+            data['weather_indicator'] = _decode('weather_indicator', next_group[1:2])
+            _decode('lowest_cloud_base', next_group[2:3])
+            data['visibility'] = _decode('visibility', next_group[3:5])
+        data['precipitation_indicator'] = precipitation_indicator
+
+        Nddff = next(groups)
+        surface_wind = None
+        if _valid(Nddff):
+            data['cloud_cover'] = _decode('cloud_cover', Nddff[0:1])
+            surface_wind = _decode('surface_wind', Nddff[1:5])
+        if surface_wind is not None:
+            speed = surface_wind["speed"]
+            if speed is not None:
+                data['wind_speed'] = speed["value"]
+                data['wind_speed_unit'] = wind_indicator["unit"] if wind_indicator is not None else None
+            data['wind_direction'] = surface_wind["direction"]
+
+        next_group = next(groups)
+        if data.get('wind_speed') == 99 and WIND_SPEED_GROUP.match(next_group):
+            data['wind_speed'] = int(next_group[2:5])
+            next_group = next(groups)
+
+        for i in range(1, 10):
+            if next_group.startswith("222") or next_group.startswith("333"):
+                header = None
+            else:
+                try:
+                    header = int(next_group[0:1])
+                except ValueError:
+                    next_group = next(groups)
+                    continue
+            if header == i:
+                if not _valid(next_group):
+                    next_group = next(groups)
+                    continue
+                if i == 1:
+                    data['air_temperature'] = _decode('temperature', next_group)
+                elif i == 2:
+                    if next_group[1:2] == "9":
+                        _decode('relative_humidity', next_group[2:5])
+                    else:
+                        data['dewpoint_temperature'] = _decode('temperature', next_group)
+                elif i == 3:
+                    data['station_pressure'] = _decode('pressure', next_group[1:5])
+                elif i == 4:
+                    a = next_group[1]
+                    if a in ["0", "9", "/"]:
+                        data['sea_level_pressure'] = _decode('pressure', next_group[1:5])
+                    elif a in ["1", "2", "5", "7", "8"]:
+                        data['geopotential'] = _decode('geopotential', next_group)
+                elif i == 5:
+                    data['pressure_tendency'] = _decode('pressure_tendency', next_group)
+                elif i == 6:
+                    # pymetdecoder only warns about a bad section 1 precipitation group
+                    if precipitation_indicator is not None and precipitation_indicator["in_group_1"]:
+                        try:
+                            data['precipitation_s1'] = _decode('precipitation', next_group)
+                        except Unsupported:
+                            pass
+                elif i == 7:
+                    data['present_weather'] = _decode('present_weather', (next_group[1:3], time_before))
+                    data['past_weather'] = [_decode('past_weather', next_group[3:4]),
+                                            _decode('past_weather', next_group[4:5])]
+                elif i == 8:
+                    data['cloud_types'] = _decode('cloud_types', next_group)
+                elif i == 9:
+                    _decode('exact_obs_time', next_group)
+                next_group = next(groups)
+            elif header is not None and header < i:
+                next_group = next(groups)
+
+        if next_group[0:3] == "222":
+            raise Unsupported("section 2")
+
+        ### Section 3 ###
+        if next_group == "333":
+            next_group = next(groups)
+            last_header = None
+            while True:
+                if next_group == "444" or next_group == "555":
+                    break
+                try:
+                    header = int(next_group[0])
+                except Exception:
+                    next_group = next(groups)
+                    continue
+                if last_header is not None and header < last_header and group_5 is None:
+                    break
+
+                if 0 <= header <= 6 and group_5 is not None:
+                    msg_5.append(next_group)
+                elif header == 0:
+                    raise Unsupported(next_group)
+                elif header == 1:
+                    data['maximum_temperature'] = _decode('temperature', next_group)
+                elif header == 2:
+                    data['minimum_temperature'] = _decode('temperature', next_group)
+                elif header == 3:
+                    if region not in GROUND_STATE_REGIONS:
+                        next_group = next(groups)
+                        continue
+                    _decode('ground_state', next_group)
+                elif header == 4:
+                    _decode('ground_state_snow', next_group)
+                elif header == 5:
+                    if len(next_group) == 5:
+                        j = next_group[1]
+                        if j in "0123":
+                            _decode('evapotranspiration', next_group)
+                        elif j == "4":
+                            data['temperature_change'] = _decode('temperature_change', next_group[2:5])
+                        elif j == "5":
+                            if not (next_group[2] in "0123/" or (next_group[2] in "45" and next_group[3:5] in ["07", "08"])):
+                                raise Unsupported(next_group)
+                            group_5 = next_group
+                            msg_5.append(group_5)
+                        elif j == "6":
+                            _decode('cloud_drift_direction', next_group)
+                        elif j == "7":
+                            _decode('cloud_elevation', next_group)
+                        elif j in "89":
+                            data['pressure_change'] = _decode('pressure_change', next_group)
+                elif header == 6:
+                    if precipitation_indicator is not None and precipitation_indicator["in_group_3"]:
+                        data['precipitation_s3'] = _decode('precipitation', next_group)
+                elif header == 7:
+                    if region == "Antarctic":
+                        raise Unsupported(next_group)
+                    data['precipitation_24h'] = _decode('precipitation_24h', next_group)
+                elif header == 8:
+                    _decode('cloud_layer', next_group)
+                elif header == 9:
+                    if len(next_group) == 5:
+                        group_9.append(next_group)
+                last_header = header
+                next_group = next(groups)
+
+        if group_9:
+            _check_group_9_state(data, group_9, time_before, wind_code)
+            group_9 = []
+
+        ### Sections 4 and 5 ###
+        if next_group == "444":
+            raise Unsupported("section 4")
+        if next_group != "555":
+            next_group = next(groups)
+        if next_group == "555":
+            while True:
+                next(groups)
+        return _row(data, time_str, wind_indicator)
+    except StopIteration:
+        pass
+
+    if group_9:
+        _check_group_9_state(data, group_9, time_before, wind_code)
+    if msg_5:
+        _check_section_3_group_5(data, msg_5)
+    return _row(data, time_str, wind_indicator)
+
+def _check_group_9_state(data, group_9, time_before, wind_code):
+    present = data.get('present_weather', _MISSING)
+    if present is not _MISSING and present is not None:
+        present = present["value"]
+    past = data.get('past_weather', _MISSING)
+    if past is not _MISSING:
+        past = tuple(w is None for w in past)
+    _decode('group_9', (tuple(group_9), time_before, wind_code, present, past))
+
+def _check_section_3_group_5(data, msg_5):
+    # Sunshine and radiation groups after 55xxx; a trailing 6RRRt among them
+    # is the section 3 precipitation
+    for m in msg_5:
+        if m.startswith("55"):
+            g5 = m
+            _decode('sunshine', m)
+        else:
+            if g5[2] == "3":
+                radiation = (m[1:5], "kJ/m2", 1)
+            else:
+                radiation = (m[1:5], "J/cm2", 24)
+            _decode('radiation', radiation)
+    if msg_5[-1].startswith("6"):
+        precipitation_indicator = data['precipitation_indicator']
+        if precipitation_indicator is None:
+            raise Unsupported("precipitation indicator")
+        if precipitation_indicator["in_group_3"]:
+            data['precipitation_s3'] = _decode('precipitation', msg_5[-1])
+
+def _precipitation(data):
+    amounts = [None] * 6
+    unit = None
+    for key in ('precipitation_s1', 'precipitation_s3'):
+        slot = PRECIPITATION_HOURS.get(_get(data.get(key), 'time_before_obs', 'value'))
+        if slot is None:
+            continue
+        amount = _get(data.get(key), 'amount', 'value')
+        if amount is not None:
+            amounts[slot] = amount
+        amount_unit = _get(data.get(key), 'amount', 'unit')
+        if amount_unit is not None:
+            unit = amount_unit
+    return amounts, unit
+
+def _cloud_types(cloud_types):
+    low = _get(cloud_types, 'low_cloud_type', 'value')
+    middle = _get(cloud_types, 'middle_cloud_type', 'value')
+    if low is None or middle is None:
+        return None, _get(cloud_types, 'cloud_amount', 'value'), _get(cloud_types, 'cloud_amount', 'unit')
+    if low > 0:
+        return "low", _get(cloud_types, 'low_cloud_amount', 'value'), _get(cloud_types, 'low_cloud_amount', 'unit')
+    if middle > 0:
+        return "middle", _get(cloud_types, 'middle_cloud_amount', 'value'), _get(cloud_types, 'middle_cloud_amount', 'unit')
+    return None, None, None
+
+def _row(data, time_str, wind_indicator):
+    air = data.get('air_temperature')
+    dew = data.get('dewpoint_temperature')
+    tmin = data.get('minimum_temperature')
+    tmax = data.get('maximum_temperature')
+    change = data.get('temperature_change')
+    direction = data.get('wind_direction')
+    direction_value = _get(direction, 'value')
+    sea_level = data.get('sea_level_pressure')
+    sea_level_value = _get(sea_level, 'value')
+    sea_level_unit = _get(sea_level, 'unit')
+    if sea_level_value is not None and sea_level_value < 400:
+        sea_level_value = sea_level_unit = None
+    station = data.get('station_pressure')
+    pressure_change = data.get('pressure_change')
+    geopotential = data.get('geopotential')
+    amounts, precipitation_unit = _precipitation(data)
+    visibility = data.get('visibility')
+    cloud_cover = data.get('cloud_cover')
+    if 'cloud_types' in data:
+        cloud_type, cloud_amount, cloud_amount_unit = _cloud_types(data['cloud_types'])
+    else:
+        cloud_type = cloud_amount = cloud_amount_unit = None
+    present = data.get('present_weather')
+    past_weather = None
+    for weather in data.get('past_weather') or ():
+        if weather is not None:
+            past_weather = weather['value']
+            break
+    cover = _get(cloud_cover, 'value')
+    return (
+        data.get('station_id'), time_str,
+        _get(air, 'value'), _get(air, 'unit'), _get(dew, 'value'), _get(dew, 'unit'),
+        _get(tmin, 'value'), _get(tmin, 'unit'), _get(tmax, 'value'), _get(tmax, 'unit'),
+        _get(change, 'change', 'value'), _get(change, 'change', 'unit'),
+        _get(wind_indicator, 'value'), _get(wind_indicator, 'unit'),
+        data.get('wind_speed'), data.get('wind_speed_unit'),
+        direction_value, _get(direction, 'unit') if direction_value is not None else None,
+        sea_level_value, sea_level_unit, _get(station, 'value'), _get(station, 'unit'),
+        _get(pressure_change, 'value'), _get(pressure_change, 'unit'),
+        _get(data.get('pressure_tendency'), 'tendency', 'value'),
+        _get(geopotential, 'surface', 'value'), _get(geopotential, 'surface', 'unit'),
+        _get(geopotential, 'height', 'value'), _get(geopotential, 'height', 'unit'),
+        _get(data.get('precipitation_indicator'), 'value'),
+        *amounts,
+        _get(data.get('precipitation_24h'), 'amount', 'value'), precipitation_unit,
+        # decoding.py's lowest cloud base and cloud drift lookups never yield a value
+        None, None, None,
+        _get(visibility, 'value'), _get(visibility, 'unit'),
+        0 if cover is None else cover, _get(cloud_cover, 'unit'),
+        cloud_type, cloud_amount, cloud_amount_unit,
+        _get(data.get('weather_indicator'), 'value'),
+        _get(present, 'value'), _get(present, 'time_before_obs', 'value'), _get(present, 'time_before_obs', 'unit'),
+        past_weather,
+        None, None, None,
+    )
+
+def report_header(time_str):
+    """Decoded YYGGi values shared by every line of a bulletin file, or None if pymetdecoder rejects them."""
+    try:
+        obs_time = _decode('obs_time', time_str[0:4])
+        wind_indicator = _decode('wind_indicator', time_str[4])
+    except Unsupported:
+        return None
+    return time_str[4], wind_indicator, time_before_default(obs_time)
+
+def decode_lines(lines, time_str, columns=None):
+    """Decode bulletin lines (station group onwards) into FIELDS columns.
+
+    Returns (columns, fallback) where fallback lists the positions of lines
+    the fast path could not handle; their column slots hold None. `columns`
+    may be buffers the caller allocated once, with at least len(lines)
+    slots per field; they are filled from the start and returned."""
+    tokens = [line.split() for line in lines]
+    if columns is None:
+        columns = {field: [None] * len(tokens) for field in FIELDS}
+    buffers = [columns[field] for field in FIELDS]
+    header = report_header(time_str)
+    if header is None:
+        for buffer in buffers:
+            buffer[:len(tokens)] = [None] * len(tokens)
+        return columns, list(range(len(tokens)))
+
+    fallback = []
+    for position, groups in enumerate(tokens):
+        try:
+            row = parse_groups(groups, time_str, header)
+        except Unsupported:
+            fallback.append(position)
+            for buffer in buffers:
+                buffer[position] = None
+            continue
+        for buffer, value in zip(buffers, row):
+            buffer[position] = value
+    return columns, fallback
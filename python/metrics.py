@@ -0,0 +1,238 @@
+import os,sys,json,time,glob,fcntl,threading,atexit
+from collections import defaultdict
+from contextlib import contextmanager
+
+# Lightweight counters and histograms. Every process (gunicorn worker or the
+# scheduler) keeps its own values and periodically writes them to
+# METRICS_DIR/<pid>-<start>.json; /metrics sums the files of all processes.
+# The files of processes that have exited are folded into TOTALS_FILE and
+# deleted, so the directory holds one file per live process. Offline tools
+# call disable() so their runs never reach the service's totals.
+METRICS_DIR = os.environ.get('METRICS_DIR', 'metrics_data')
+TOTALS_FILE = 'totals.json'
+METRIC_PREFIX = 'weather_'
+FLUSH_INTERVAL = 5.0
+BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+_lock = threading.Lock()
+_counters = defaultdict(float)
+_histograms = {}
+_process_id = None
+_last_flush = 0.0
+_enabled = True
+
+
+def _reset():
+    global _lock, _process_id, _last_flush
+    _lock = threading.Lock()
+    _counters.clear()
+    _histograms.clear()
+    _process_id = f'{os.getpid()}-{int(time.time() * 1000)}'
+    _last_flush = 0.0
+
+_reset()
+# A worker forked from a preloaded app must not report its parent's values again
+os.register_at_fork(after_in_child=_reset)
+
+
+def disable():
+    """Stop writing this process's values, for benchmarks and other offline runs."""
+    global _enabled
+    _enabled = False
+
+def _key(name, labels):
+    return (name, tuple(sorted(labels.items())))
+
+def inc(name, value=1, **labels):
+    with _lock:
+        _counters[_key(name, labels)] += value
+    _maybe_flush()
+
+def observe(name, seconds, **labels):
+    key = _key(name, labels)
+    with _lock:
+        histogram = _histograms.get(key)
+        if histogram is None:
+            histogram = _histograms[key] = {'buckets': [0] * len(BUCKETS), 'sum': 0.0, 'count': 0}
+        for i, bound in enumerate(BUCKETS):
+            if seconds <= bound:
+                histogram['buckets'][i] += 1
+                break
+        histogram['sum'] += seconds
+        histogram['count'] += 1
+    _maybe_flush()
+
+@contextmanager
+def timer(name, **labels):
+    """Observe the duration of the block in the `name` histogram."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(name, time.perf_counter() - start, **labels)
+
+def _maybe_flush():
+    if time.monotonic() - _last_flush >= FLUSH_INTERVAL:
+        flush()
+
+def flush():
+    """Write this process's values to its file in METRICS_DIR."""
+    global _last_flush
+    if not _enabled:
+        return
+    with _lock:
+        _last_flush = time.monotonic()
+        snapshot = {
+            'counters': [[name, labels, value] for (name, labels), value in _counters.items()],
+            'histograms': [[name, labels, h] for (name, labels), h in _histograms.items()],
+        }
+        path = os.path.join(METRICS_DIR, f'{_process_id}.json')
+    try:
+        os.makedirs(METRICS_DIR, exist_ok=True)
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(snapshot, f)
+        os.replace(tmp_path, path)
+    except OSError as e:
+        print(f"Could not write metrics: {e}")
+
+atexit.register(flush)
+
+def _add(counters, histograms, snapshot):
+    for name, labels, value in snapshot['counters']:
+        counters[(name, tuple(map(tuple, labels)))] += value
+    for name, labels, h in snapshot['histograms']:
+        key = (name, tuple(map(tuple, labels)))
+        total = histograms.setdefault(key, {'buckets': [0] * len(BUCKETS), 'sum': 0.0, 'count': 0})
+        total['buckets'] = [a + b for a, b in zip(total['buckets'], h['buckets'])]
+        total['sum'] += h['sum']
+        total['count'] += h['count']
+
+def _read_snapshot(path):
+    try:
+        with open(path, 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+def fold_exited():
+    """Add the values of processes that have exited to TOTALS_FILE and delete their files."""
+    if not os.path.isdir(METRICS_DIR):
+        return 0
+    with open(os.path.join(METRICS_DIR, '.lock'), 'w') as lock:
+        # Workers scraping at the same time must not fold a file twice
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        exited = [path for path in glob.glob(os.path.join(METRICS_DIR, '*-*.json'))
+                  if not _alive(int(os.path.basename(path).split('-')[0]))]
+        if not exited:
+            return 0
+        counters, histograms = defaultdict(float), {}
+        totals_path = os.path.join(METRICS_DIR, TOTALS_FILE)
+        for path in [totals_path] + exited:
+            snapshot = _read_snapshot(path)
+            if snapshot is not None:
+                _add(counters, histograms, snapshot)
+        tmp_path = totals_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump({
+                'counters': [[name, labels, value] for (name, labels), value in counters.items()],
+                'histograms': [[name, labels, h] for (name, labels), h in histograms.items()],
+            }, f)
+        os.replace(tmp_path, totals_path)
+        for path in exited:
+            os.remove(path)
+    return len(exited)
+
+def collect():
+    """Sum the values written by every process."""
+    fold_exited()
+    counters = defaultdict(float)
+    histograms = {}
+    for path in glob.glob(os.path.join(METRICS_DIR, '*.json')):
+        snapshot = _read_snapshot(path)
+        if snapshot is not None:
+            _add(counters, histograms, snapshot)
+    return counters, histograms
+
+def _format_labels(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"') for _, value in pairs)
+    return '{' + ','.join(f'{key}="{value}"' for (key, _), value in zip(pairs, escaped)) + '}'
+
+def render_prometheus():
+    """All processes' metrics in the Prometheus text exposition format."""
+    flush()
+    counters, histograms = collect()
+    lines = []
+    seen = set()
+    for (name, labels), value in sorted(counters.items()):
+        metric = METRIC_PREFIX + name
+        if metric not in seen:
+            lines.append(f'# TYPE {metric} counter')
+            seen.add(metric)
+        lines.append(f'{metric}{_format_labels(labels)} {value:g}')
+    for (name, labels), h in sorted(histograms.items()):
+        metric = METRIC_PREFIX + name
+        if metric not in seen:
+            lines.append(f'# TYPE {metric} histogram')
+            seen.add(metric)
+        cumulative = 0
+        for bound, count in zip(BUCKETS, h['buckets']):
+            cumulative += count
+            lines.append(f'{metric}_bucket{_format_labels(labels, [("le", f"{bound:g}")])} {cumulative}')
+        lines.append(f'{metric}_bucket{_format_labels(labels, [("le", "+Inf")])} {h["count"]}')
+        lines.append(f'{metric}_sum{_format_labels(labels)} {h["sum"]:.6f}')
+        lines.append(f'{metric}_count{_format_labels(labels)} {h["count"]}')
+    return '\n'.join(lines) + '\n'
+
+
+# Sampling profiler. Touch PROFILE_FLAG and the next cycle run by main()
+# is sampled; the flag is removed afterwards so only that cycle pays for it.
+PROFILE_FLAG = 'profile_next_cycle'
+PROFILE_DIR = 'profiles'
+
+def profile_requested():
+    return os.path.exists(PROFILE_FLAG)
+
+@contextmanager
+def sampling_profiler(output_path, interval=0.005):
+    """Sample the calling thread's stack every `interval` seconds and write
+    the counts as collapsed stacks (flamegraph.pl input) to output_path."""
+    target = threading.get_ident()
+    stacks = defaultdict(int)
+    stop = threading.Event()
+
+    def sample():
+        while not stop.wait(interval):
+            frame = sys._current_frames().get(target)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f'{os.path.basename(code.co_filename)}:{code.co_name}')
+                frame = frame.f_back
+            if stack:
+                stacks[';'.join(reversed(stack))] += 1
+
+    sampler = threading.Thread(target=sample, daemon=True)
+    sampler.start()
+    try:
+        yield
+    finally:
+        stop.set()
+        sampler.join()
+        os.makedirs(os.path.dirname(output_path) or '.', exist_ok=True)
+        with open(output_path, 'w') as f:
+            for stack, count in sorted(stacks.items(), key=lambda item: -item[1]):
+                f.write(f'{stack} {count}\n')
+        print(f'Profile saved to {output_path}')
@@ -0,0 +1,123 @@
+import io,os,multiprocessing
+import numpy as np
+import matplotlib
+matplotlib.use('Agg')
+import matplotlib.pyplot as plt
+from matplotlib.backends.backend_svg import FigureCanvasSVG
+from metpy.plots import StationPlot, sky_cover, current_weather, pressure_tendency as pt_symbols
+from concurrent.futures import ProcessPoolExecutor
+from python.contours import read_data
+from python.wind import wind_components
+
+# Station model SVGs for /generate_svg. Rendering is CPU bound, so with
+# SERVING_MODE=async (gevent workers, see gunicorn.conf.py) it runs in a
+# pool of RENDER_PROCESSES processes per worker instead of on the event
+# loop, which keeps serving other connections while a render is running.
+SERVING_MODE = os.environ.get('SERVING_MODE', 'sync')
+RENDER_PROCESSES = int(os.environ.get('SVG_RENDER_PROCESSES', 0)) or os.cpu_count()
+
+_pool = None
+
+
+def optional(value, convert=float):
+    return convert(value) if not np.isnan(value) else None
+
+def render_station(station_id, time_stamp):
+    data = read_data(time_stamp)
+
+    data = data.drop_duplicates(subset='station_id')
+
+    station_data = data[data['station_id'] == station_id]
+
+    if station_data.empty:
+        raise ValueError(f"No station found with station_id: {station_id}. Please check the data.")
+
+    closest_station = station_data.iloc[0]
+
+    air_temp = optional(closest_station['air_temp'])
+    dew_point = optional(closest_station['dew_point'])
+    pressure = optional(closest_station['pressure_sea_level'])
+    pressure_station = optional(closest_station['pressure_station_level'])
+    wind_speed_knots = optional(closest_station['wind_speed'])
+    wind_dir = optional(closest_station['wind_direction'])
+    cloud_cover_value = optional(closest_station['cloud_cover'], lambda value: int(round(value)))
+    lat = closest_station['Latitude']
+    lon = closest_station['Longitude']
+    weather_code = optional(closest_station['present_weather'], int)
+    pressure_tendency = optional(closest_station['tendency'], int)
+    pressure_change = optional(closest_station['pressure_change'])
+    Place = closest_station['Place_Name']
+
+    # Create a station plot
+    fig = plt.figure(figsize=(2, 2), dpi=300)
+    ax = fig.add_subplot(1, 1, 1)
+
+    station_plot = StationPlot(ax, lon, lat, fontsize=15, spacing=25)
+
+    # Plot temperature if available
+    if air_temp is not None:
+        station_plot.plot_parameter('NW', [air_temp], color='red')
+    station_plot.plot_parameter('SW', [dew_point], color='red')
+    # Plot pressure if available
+    if pressure is not None:
+        station_plot.plot_parameter('NE', [pressure], color='black')
+    if weather_code is not None:
+        station_plot.plot_symbol('W', [weather_code], current_weather, fontsize=12)
+    # Plot wind barb if wind data is available
+    if wind_speed_knots is not None and wind_dir is not None:
+        u, v = wind_components(wind_speed_knots, wind_dir)
+        station_plot.plot_barb(u=[u], v=[v])
+
+    # Plot cloud cover if available
+    if cloud_cover_value is not None:
+        station_plot.plot_symbol('C', [cloud_cover_value], sky_cover)
+
+    # Plot pressure tendency if available
+    if pressure_tendency is not None:
+        station_plot.plot_symbol((1.8, 0.1), [pressure_tendency], pt_symbols)
+    # Plot pressure change if available
+    if pressure_change is not None:
+        station_plot.plot_parameter((1, 0.1), [pressure_change], color='green')
+
+    # Convert plot to SVG
+    svg_buffer = io.StringIO()
+    canvas = FigureCanvasSVG(fig)
+    canvas.draw()
+    canvas.print_svg(svg_buffer)
+    plt.close(fig)
+
+    svg_data = svg_buffer.getvalue()
+    svg_buffer.close()
+
+    return {
+        'station_id': station_id,
+        'timestamp': time_stamp,
+        'svg': svg_data,
+        'additional_data': {
+            'air_temp': air_temp,
+            'dew_point': dew_point,
+            'pressure': pressure_station,
+            'wind_speed_knots': wind_speed_knots,
+            'wind_dir': wind_dir,
+            'cloud_cover_value': cloud_cover_value,
+            'lat': round(lat, 3) ,
+            'lon': round(lon, 3) ,
+            'weather_code': weather_code,
+            'pressure_tendency': pressure_tendency,
+            'pressure_change': pressure_change,
+            'place_name':Place
+        }
+    }
+
+def render_pool():
+    """The worker's render processes, started on first use. They are spawned
+    rather than forked so they do not inherit the gevent hub and sockets."""
+    global _pool
+    if _pool is None:
+        _pool = ProcessPoolExecutor(max_workers=RENDER_PROCESSES, mp_context=multiprocessing.get_context('spawn'))
+    return _pool
+
+def station_svg(station_id, time_stamp):
+    if SERVING_MODE == 'async':
+        return render_pool().submit(render_station, station_id, time_stamp).result()
+    return render_station(station_id, time_stamp)
@@ -0,0 +1,206 @@
+import os,io,shutil
+import numpy as np
+from PIL import Image
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone
+from python.contours import load_grid
+from python.metrics import inc
+from python.catalog import cycle_info
+
+# Colour-shaded XYZ tiles rendered from the cached analysis grids.
+TILE_DIR = 'tiles_cache'
+TILE_SIZE = 256
+PYRAMID_ZOOMS = range(4, 8)
+TILE_CACHE_MAX_BYTES = int(os.environ.get('TILE_CACHE_MAX_MB', 512)) * 1024 * 1024
+TILE_FORMATS = {'png': 'PNG', 'webp': 'WEBP'}
+ALPHA = 160
+
+# field -> (grid name, colour stops as (value, (r, g, b)))
+TILE_FIELDS = {
+    'pressure': ('pressure_sea_level', [
+        (980, (149, 137, 211)), (995, (95, 143, 197)), (1005, (129, 204, 197)),
+        (1013, (240, 240, 240)), (1020, (223, 177, 6)), (1030, (236, 95, 21)), (1045, (150, 30, 30)),
+    ]),
+    'temperature': ('air_temp', [
+        (-40, (149, 137, 211)), (-20, (150, 209, 216)), (-10, (129, 204, 197)), (0, (103, 180, 186)),
+        (5, (95, 143, 197)), (10, (80, 140, 62)), (15, (121, 146, 28)), (20, (171, 161, 14)),
+        (30, (223, 177, 6)), (45, (236, 95, 21)),
+    ]),
+    'dew_point': ('dew_point', [
+        (-45, (120, 80, 40)), (-20, (171, 161, 14)), (-5, (240, 240, 200)),
+        (5, (129, 204, 197)), (15, (80, 140, 62)), (25, (20, 90, 40)),
+    ]),
+}
+
+_renders_since_cleanup = 0
+
+
+def colour_table(stops, size=256):
+    """Lookup table of `size` RGB colours spanning the stop values."""
+    values = np.array([value for value, _ in stops], dtype=float)
+    colours = np.array([colour for _, colour in stops], dtype=float)
+    samples = np.linspace(values[0], values[-1], size)
+    table = np.stack([np.interp(samples, values, colours[:, c]) for c in range(3)], axis=1)
+    return table.astype(np.uint8), values[0], values[-1]
+
+COLOUR_TABLES = {field: colour_table(stops) for field, (_, stops) in TILE_FIELDS.items()}
+
+def tile_lonlat(z, x, y):
+    """Longitudes of the tile's pixel columns and latitudes of its pixel rows."""
+    n = 2 ** z
+    offsets = (np.arange(TILE_SIZE) + 0.5) / TILE_SIZE
+    lons = (x + offsets) / n * 360.0 - 180.0
+    lats = np.degrees(np.arctan(np.sinh(np.pi * (1 - 2 * (y + offsets) / n))))
+    return lons, lats
+
+def sample_grid(lon_arr, lat_arr, grid, lons, lats):
+    """Bilinear samples of grid at every (lat row, lon column); NaN outside the grid."""
+    fi = (lons - lon_arr[0]) / (lon_arr[-1] - lon_arr[0]) * (len(lon_arr) - 1)
+    fj = (lats - lat_arr[0]) / (lat_arr[-1] - lat_arr[0]) * (len(lat_arr) - 1)
+    inside = ((fi >= 0) & (fi <= len(lon_arr) - 1))[None, :] & ((fj >= 0) & (fj <= len(lat_arr) - 1))[:, None]
+    i0 = np.clip(np.floor(fi).astype(int), 0, len(lon_arr) - 2)[None, :]
+    j0 = np.clip(np.floor(fj).astype(int), 0, len(lat_arr) - 2)[:, None]
+    wi = np.clip(fi[None, :] - i0, 0, 1)
+    wj = np.clip(fj[:, None] - j0, 0, 1)
+    values = (grid[i0, j0] * (1 - wi) * (1 - wj) + grid[i0 + 1, j0] * wi * (1 - wj)
+              + grid[i0, j0 + 1] * (1 - wi) * wj + grid[i0 + 1, j0 + 1] * wi * wj)
+    return np.where(inside, values, np.nan)
+
+def render_tile(field, grid_data, z, x, y, fmt='png'):
+    lon_arr, lat_arr, grid = grid_data
+    lons, lats = tile_lonlat(z, x, y)
+    values = sample_grid(lon_arr, lat_arr, grid, lons, lats)
+
+    table, vmin, vmax = COLOUR_TABLES[field]
+    valid = ~np.isnan(values)
+    index = np.clip((np.nan_to_num(values, nan=vmin) - vmin) / (vmax - vmin) * (len(table) - 1), 0, len(table) - 1)
+    rgba = np.zeros(values.shape + (4,), dtype=np.uint8)
+    rgba[..., :3] = table[index.astype(np.intp)]
+    rgba[..., 3] = np.where(valid, ALPHA, 0)
+
+    buffer = io.BytesIO()
+    Image.fromarray(rgba, 'RGBA').save(buffer, format=TILE_FORMATS[fmt])
+    return buffer.getvalue()
+
+def tile_path(field, timestamp, z, x, y, fmt='png'):
+    return os.path.join(TILE_DIR, field, str(timestamp), str(z), str(x), f'{y}.{fmt}')
+
+def write_tile(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+def tiles_for_bounds(lon_arr, lat_arr, z):
+    n = 2 ** z
+    def tile_x(lon):
+        return int(np.clip((lon + 180.0) / 360.0 * n, 0, n - 1))
+    def tile_y(lat):
+        lat = np.radians(np.clip(lat, -85.05, 85.05))
+        return int(np.clip((1 - np.arcsinh(np.tan(lat)) / np.pi) / 2 * n, 0, n - 1))
+    xs = range(tile_x(lon_arr.min()), tile_x(lon_arr.max()) + 1)
+    ys = range(tile_y(lat_arr.max()), tile_y(lat_arr.min()) + 1)
+    return [(z, x, y) for x in xs for y in ys]
+
+def get_tile(field, timestamp, z, x, y, fmt='png'):
+    """Tile bytes from the disk cache, rendering and caching them on a miss. None if there is no grid."""
+    global _renders_since_cleanup
+    path = tile_path(field, timestamp, z, x, y, fmt)
+    # Tiles older than the cycle's last publication were rendered from grids it has since replaced
+    info = cycle_info(timestamp)
+    try:
+        fresh = os.stat(path).st_mtime >= (info[1] if info else 0)
+    except FileNotFoundError:
+        fresh = False
+    if fresh:
+        inc('cache_requests_total', cache='tiles', result='hit')
+        os.utime(path)
+        with open(path, 'rb') as f:
+            return f.read()
+
+    inc('cache_requests_total', cache='tiles', result='miss')
+    grid_data = load_grid(timestamp, TILE_FIELDS[field][0])
+    if grid_data is None:
+        return None
+    data = render_tile(field, grid_data, z, x, y, fmt)
+    write_tile(path, data)
+    _renders_since_cleanup += 1
+    if _renders_since_cleanup >= 200:
+        _renders_since_cleanup = 0
+        enforce_cache_limit()
+    return data
+
+_worker_grids = {}
+
+def _load_worker_grids(timestamp):
+    for field, (grid_name, _) in TILE_FIELDS.items():
+        _worker_grids[field] = load_grid(timestamp, grid_name)
+
+def _render_to_cache(args):
+    field, timestamp, z, x, y = args
+    data = render_tile(field, _worker_grids[field], z, x, y)
+    write_tile(tile_path(field, timestamp, z, x, y), data)
+    return len(data)
+
+def generate_tiles(timestamp, zooms=PYRAMID_ZOOMS, workers=None):
+    """Render the tile pyramid of every field for a cycle, one zoom level at a time across worker processes."""
+    grids = {field: load_grid(timestamp, grid_name) for field, (grid_name, _) in TILE_FIELDS.items()}
+    grids = {field: grid for field, grid in grids.items() if grid is not None}
+    if not grids:
+        print(f"No grids cached for {timestamp}, skipping tiles")
+        return 0
+
+    count = 0
+    with ProcessPoolExecutor(max_workers=workers, initializer=_load_worker_grids, initargs=(timestamp,)) as executor:
+        for z in zooms:
+            jobs = [(field, timestamp) + tile
+                    for field, (lon_arr, lat_arr, _) in grids.items()
+                    for tile in tiles_for_bounds(lon_arr, lat_arr, z)]
+            count += sum(1 for _ in executor.map(_render_to_cache, jobs, chunksize=16))
+    print(f"Rendered {count} tiles for {timestamp}")
+    enforce_cache_limit()
+    return count
+
+def enforce_cache_limit(max_bytes=TILE_CACHE_MAX_BYTES):
+    """Evict least recently used tiles until the cache is under 90% of max_bytes."""
+    entries = []
+    total = 0
+    for root, _, files in os.walk(TILE_DIR):
+        for name in files:
+            path = os.path.join(root, name)
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+            total += stat.st_size
+    if total <= max_bytes:
+        return 0
+    removed = 0
+    for _, size, path in sorted(entries):
+        if total <= max_bytes * 0.9:
+            break
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        total -= size
+        removed += 1
+    print(f"Evicted {removed} tiles from {TILE_DIR}")
+    return removed
+
+def delete_old_tiles(days=10):
+    current_time = datetime.now(timezone.utc)
+    for field in TILE_FIELDS:
+        field_dir = os.path.join(TILE_DIR, field)
+        if not os.path.isdir(field_dir):
+            continue
+        for timestamp in os.listdir(field_dir):
+            try:
+                tile_time = datetime.strptime(timestamp, "%Y%m%d%H").replace(tzinfo=timezone.utc)
+            except ValueError:
+                continue
+            if (current_time - tile_time).days > days:
+                print("Removing tiles:", os.path.join(field_dir, timestamp))
+                shutil.rmtree(os.path.join(field_dir, timestamp), ignore_errors=True)
@@ -0,0 +1,177 @@
+import os,json
+import numpy as np
+import pandas as pd
+from datetime import datetime, timedelta, timezone
+from python.delete import delete_file
+
+# Append-only per-station history. Each day of cycles goes into one chunk
+# file of fixed-size records named after the day's 00 UTC cycle, so the
+# same 10 day retention as the other data directories applies to it.
+TIMESERIES_DIR = "Timeseries"
+STATION_INDEX_FILE = "stations.json"
+RETENTION_DAYS = 10
+
+TIMESERIES_FIELDS = [
+    'air_temp', 'dew_point', 'min_temp', 'max_temp', 'wind_speed', 'wind_direction',
+    'pressure_sea_level', 'pressure_station_level', 'pressure_change', 'tendency',
+    'cloud_cover', 'visibility', 'present_weather', 'precipitation24H'
+]
+
+RECORD_DTYPE = np.dtype(
+    [('timestamp', '<i8'), ('station_id', '<i4')] + [(field, '<f4') for field in TIMESERIES_FIELDS]
+)
+
+
+def chunk_name(timestamp):
+    return f"{str(timestamp)[:8]}00.bin"
+
+def chunk_path(timestamp, directory=TIMESERIES_DIR):
+    return os.path.join(directory, chunk_name(timestamp))
+
+def read_chunk(path):
+    if not os.path.exists(path):
+        return np.empty(0, dtype=RECORD_DTYPE)
+    return np.fromfile(path, dtype=RECORD_DTYPE)
+
+def load_station_index(directory=TIMESERIES_DIR):
+    """Station index: station_id -> row number plus station details."""
+    path = os.path.join(directory, STATION_INDEX_FILE)
+    if not os.path.exists(path):
+        return {}
+    with open(path, 'r') as f:
+        return {int(k): v for k, v in json.load(f).items()}
+
+def _json_value(value):
+    # Missing names and coordinates are NaN in the decoded data, which JSON has no literal for
+    return None if isinstance(value, float) and np.isnan(value) else value
+
+def save_station_index(index, directory=TIMESERIES_DIR):
+    path = os.path.join(directory, STATION_INDEX_FILE)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump({str(k): {key: _json_value(value) for key, value in v.items()} for k, v in index.items()}, f, allow_nan=False)
+    os.replace(tmp_path, path)
+
+def append_cycle(timestamp, data, directory=TIMESERIES_DIR):
+    """Append one decoded cycle (the DataFrame written to Decoded_Data) to the store."""
+    os.makedirs(directory, exist_ok=True)
+    timestamp = int(timestamp)
+    path = chunk_path(timestamp, directory)
+
+    data = data.dropna(subset=['station_id']).drop_duplicates(subset='station_id')
+    records = np.zeros(len(data), dtype=RECORD_DTYPE)
+    records['timestamp'] = timestamp
+    records['station_id'] = data['station_id'].astype(int).values
+    for field in TIMESERIES_FIELDS:
+        if field in data:
+            records[field] = pd.to_numeric(data[field], errors='coerce').values
+        else:
+            records[field] = np.nan
+
+    existing = read_chunk(path)
+    stored = existing['timestamp'] == timestamp
+    if np.any(stored):
+        # A reprocessed cycle replaces what was stored for it
+        tmp_path = path + ".tmp"
+        np.concatenate([existing[~stored], records]).tofile(tmp_path)
+        os.replace(tmp_path, path)
+        print(f"Replaced cycle {timestamp} in time series store")
+    else:
+        with open(path, 'ab') as f:
+            records.tofile(f)
+
+    index = load_station_index(directory)
+    changed = False
+    for _, row in data.iterrows():
+        station_id = int(row['station_id'])
+        if station_id not in index:
+            index[station_id] = {
+                'row': len(index),
+                'station': row.get('Station_Name'),
+                'place': row.get('Place_Name'),
+                'lat': float(row['Latitude']),
+                'lon': float(row['Longitude']),
+            }
+            changed = True
+    if changed:
+        save_station_index(index, directory)
+    print(f"Appended {len(records)} stations for {timestamp} to {path}")
+    return len(records)
+
+def chunk_paths_for_range(start, end, directory=TIMESERIES_DIR):
+    start_day = datetime.strptime(str(start)[:8], "%Y%m%d")
+    end_day = datetime.strptime(str(end)[:8], "%Y%m%d")
+    paths = []
+    day = start_day
+    while day <= end_day:
+        paths.append(chunk_path(day.strftime("%Y%m%d"), directory))
+        day += timedelta(days=1)
+    return paths
+
+def read_range(start, end, station_id=None, fields=None, directory=TIMESERIES_DIR):
+    """Return the records between two cycles, optionally for one station, sorted by time."""
+    start, end = int(start), int(end)
+    columns = ['timestamp', 'station_id'] + list(fields or TIMESERIES_FIELDS)
+    parts = []
+    for path in chunk_paths_for_range(start, end, directory):
+        records = read_chunk(path)
+        if len(records) == 0:
+            continue
+        mask = (records['timestamp'] >= start) & (records['timestamp'] <= end)
+        if station_id is not None:
+            mask &= records['station_id'] == int(station_id)
+        parts.append(records[mask][columns])
+    if not parts:
+        return np.empty(0, dtype=RECORD_DTYPE)[columns]
+    records = np.concatenate(parts)
+    return records[np.argsort(records['timestamp'], kind='stable')]
+
+def station_history(station_id, fields=None, start=None, end=None, directory=TIMESERIES_DIR):
+    fields = [f for f in (fields or TIMESERIES_FIELDS) if f in TIMESERIES_FIELDS]
+    if end is None:
+        end = datetime.now(timezone.utc).strftime("%Y%m%d%H")
+    if start is None:
+        start = (datetime.strptime(str(end), "%Y%m%d%H") - timedelta(days=RETENTION_DAYS)).strftime("%Y%m%d%H")
+    records = read_range(start, end, station_id=station_id, fields=fields, directory=directory)
+    history = {
+        'station_id': int(station_id),
+        'station': load_station_index(directory).get(int(station_id)),
+        'timestamps': [str(t) for t in records['timestamp']],
+    }
+    for field in fields:
+        values = records[field].astype(float)
+        history[field] = [None if np.isnan(v) else round(v, 2) for v in values]
+    return history
+
+def station_coordinates(index):
+    """Latitude/longitude arrays ordered by station index row."""
+    lats = np.full(len(index), np.nan)
+    lons = np.full(len(index), np.nan)
+    for entry in index.values():
+        lats[entry['row']] = entry['lat']
+        lons[entry['row']] = entry['lon']
+    return lats, lons
+
+def cycle_values(timestamp, fields, index, directory=TIMESERIES_DIR):
+    """Values of one cycle as arrays aligned to station index rows (NaN where missing)."""
+    records = read_chunk(chunk_path(timestamp, directory))
+    records = records[records['timestamp'] == int(timestamp)]
+    rows = np.array([index[int(i)]['row'] if int(i) in index else -1 for i in records['station_id']], dtype=int)
+    known = rows >= 0
+    values = {}
+    for field in fields:
+        aligned = np.full(len(index), np.nan)
+        aligned[rows[known]] = records[field][known]
+        values[field] = aligned
+    return values
+
+def delete_old_chunks(directory=TIMESERIES_DIR):
+    if os.path.exists(directory):
+        delete_file(directory)
+
+def build_from_csv(decoded_directory="Decoded_Data", directory=TIMESERIES_DIR):
+    """Backfill the store from the per-cycle CSVs already on disk."""
+    for filename in sorted(os.listdir(decoded_directory)):
+        if filename.endswith('.csv'):
+            timestamp = os.path.splitext(filename)[0]
+            append_cycle(timestamp, pd.read_csv(os.path.join(decoded_directory, filename)), directory)
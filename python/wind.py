@@ -0,0 +1,110 @@
+import os,json
+import numpy as np
+import matplotlib.pyplot as plt
+from python.contours import read_data, analysis_grid, load_grid, save_grid
+from python.animation import COORD_SCALE, encode_line
+from python.metrics import timer
+
+# Gridded wind for a cycle. Station winds are turned into u/v components
+# (knots) in one pass, gridded with the same IDW analysis as the other
+# fields on a coarser grid, and saved as WIND_DIR/<timestamp>.json with a
+# thinned arrow grid (u/v in tenths of a knot) and streamlines. Streamlines
+# are delta-encoded like the animation frames, run in the direction of the
+# flow, and start with their mean speed in knots.
+WIND_DIR = 'wind_data'
+WIND_GRID_SIZE = 200
+WIND_SIGMA = 1  # the same smoothing length as sigma=5 on the 1000-cell grids
+ARROW_STEP = 10
+STREAMLINE_DENSITY = 2
+KNOTS_PER_MPS = 1.943844
+
+
+def wind_components(speed, direction):
+    """u and v of winds blowing from `direction` degrees, in the units of `speed`."""
+    radians = np.radians(direction)
+    return -speed * np.sin(radians), -speed * np.cos(radians)
+
+def station_winds(data):
+    """Longitudes, latitudes and u/v in knots of the stations that report a wind."""
+    speed = data['wind_speed'].values.astype(float)
+    speed = np.where(data['wind_speed_unit'].values == 'm/s', speed * KNOTS_PER_MPS, speed)
+    # Calm reports carry no direction
+    direction = np.where(speed == 0, 0.0, data['wind_direction'].values.astype(float))
+    valid = ~np.isnan(speed) & ~np.isnan(direction)
+    u, v = wind_components(speed[valid], direction[valid])
+    return data['Longitude'].values[valid], data['Latitude'].values[valid], u, v
+
+def wind_path(timestamp):
+    return os.path.join(WIND_DIR, f'{timestamp}.json')
+
+def tenths(values):
+    return [None if np.isnan(value) else int(round(value * 10)) for value in values.ravel().tolist()]
+
+def arrow_grid(lon_arr, lat_arr, u_grid, v_grid, step=ARROW_STEP):
+    """Every step-th cell of the u/v grids, longitude-major like the grids themselves."""
+    start = step // 2
+    u, v = u_grid[start::step, start::step], v_grid[start::step, start::step]
+    return {
+        'lon0': round(float(lon_arr[start]), 4),
+        'lat0': round(float(lat_arr[start]), 4),
+        'dlon': round(float(lon_arr[1] - lon_arr[0]) * step, 6),
+        'dlat': round(float(lat_arr[1] - lat_arr[0]) * step, 6),
+        'nlon': u.shape[0],
+        'nlat': u.shape[1],
+        'u': tenths(u),
+        'v': tenths(v),
+    }
+
+def streamlines(lon_arr, lat_arr, u_grid, v_grid, density=STREAMLINE_DENSITY):
+    stream = plt.streamplot(lon_arr, lat_arr, u_grid.T, v_grid.T, density=density)
+    lines = stream.lines.get_segments()
+    plt.close('all')
+    speed = np.hypot(u_grid, v_grid)
+    encoded = []
+    for line in lines:
+        # Drop steps too short to survive the coordinate quantisation
+        points = np.rint(line * COORD_SCALE)
+        line = line[np.r_[True, (np.diff(points, axis=0) != 0).any(axis=1)]]
+        if len(line) < 2:
+            continue
+        i = np.clip(np.rint((line[:, 0] - lon_arr[0]) / (lon_arr[1] - lon_arr[0])).astype(int), 0, len(lon_arr) - 1)
+        j = np.clip(np.rint((line[:, 1] - lat_arr[0]) / (lat_arr[1] - lat_arr[0])).astype(int), 0, len(lat_arr) - 1)
+        encoded.append(encode_line(round(float(np.nanmean(speed[i, j]))), line))
+    return encoded
+
+def generate_wind(timestamp):
+    """Grid u/v for a cycle on the pressure analysis' domain and save the arrow grid and streamlines."""
+    data = read_data(timestamp)
+    if data is None:
+        return None
+    data = data.drop_duplicates(subset='station_id')
+    lons, lats, u, v = station_winds(data)
+    if len(lons) < 3:
+        print(f"Not enough wind reports for {timestamp}")
+        return None
+
+    base = load_grid(timestamp, 'pressure_sea_level')
+    lon_range = (base[0][0], base[0][-1]) if base is not None else (lons.min(), lons.max())
+    lat_range = (base[1][0], base[1][-1]) if base is not None else (lats.min(), lats.max())
+    lon_arr = np.linspace(*lon_range, WIND_GRID_SIZE)
+    lat_arr = np.linspace(*lat_range, WIND_GRID_SIZE)
+    _, _, u_grid = analysis_grid(lons, lats, u, lon_arr, lat_arr, sigma=WIND_SIGMA)
+    _, _, v_grid = analysis_grid(lons, lats, v, lon_arr, lat_arr, sigma=WIND_SIGMA)
+    save_grid(timestamp, 'wind_u', lon_arr, lat_arr, u_grid)
+    save_grid(timestamp, 'wind_v', lon_arr, lat_arr, v_grid)
+
+    with timer('pipeline_stage_seconds', stage='streamlines'):
+        product = {
+            'timestamp': str(timestamp),
+            'arrows': arrow_grid(lon_arr, lat_arr, u_grid, v_grid),
+            'streamlines': streamlines(lon_arr, lat_arr, u_grid, v_grid),
+        }
+    text = json.dumps(product, separators=(',', ':'))
+    os.makedirs(WIND_DIR, exist_ok=True)
+    path = wind_path(timestamp)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        f.write(text)
+    os.replace(tmp_path, path)
+    print(f'Wind saved to {path}')
+    return path
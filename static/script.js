@@ -366,8 +366,47 @@ function onMarkerClick(code, time_stamp) {
       console.error("Error fetching SVG data:", error);
     });
 }
+// Wind: /api/wind has an arrow grid (u/v in tenths of a knot) and
+// streamlines encoded like the animation lines, starting with the mean speed.
+var windLayer = L.layerGroup();
+
+function windColor(speed) {
+  return getColor(Math.min(speed, 30), 0, 30);
+}
+
+async function fetchAndPlotWind(timestamp) {
+  windLayer.clearLayers();
+  var data = cachedData[timestamp] && cachedData[timestamp].wind;
+  if (!data) {
+    const response = await fetch(`/api/wind?timestamp=${timestamp}`);
+    if (!response.ok) {
+      return;
+    }
+    data = await response.json();
+    cachedData[timestamp] = { ...cachedData[timestamp], wind: data };
+  }
+  data.streamlines.forEach((line) => {
+    var latlngs = decodeLine(line).map(([lon, lat]) => [lat, lon]);
+    L.polyline(latlngs, { color: windColor(line[0]), weight: 1, opacity: 0.8 }).addTo(windLayer);
+  });
+  var arrows = data.arrows;
+  var scale = Math.min(arrows.dlon, arrows.dlat) / 20; // degrees per knot, so 20 kt spans one cell
+  for (var i = 0; i < arrows.nlon; i++) {
+    for (var j = 0; j < arrows.nlat; j++) {
+      var k = i * arrows.nlat + j;
+      if (arrows.u[k] === null || arrows.v[k] === null) continue;
+      var lon = arrows.lon0 + i * arrows.dlon;
+      var lat = arrows.lat0 + j * arrows.dlat;
+      var tip = [lat + (arrows.v[k] / 10) * scale, lon + (arrows.u[k] / 10) * scale];
+      L.polyline([[lat, lon], tip], { color: "#333", weight: 1.5 }).addTo(windLayer);
+    }
+  }
+  windLayer.addTo(map);
+}
+
 addTemperatureMarkers(timestamp);
 fetchAndPlotGeoJSON(timestamp);
+fetchAndPlotWind(timestamp);
 button.addEventListener("click", function () {
   markers.clearLayers();
   if (geoJsonLayer) {
@@ -381,4 +420,106 @@ button.addEventListener("click", function () {
   currentTimestamp = formattedDate; // Update the current timestamp
   addTemperatureMarkers(formattedDate);
   fetchAndPlotGeoJSON(formattedDate);
+  fetchAndPlotWind(formattedDate);
+});
+
+// Animation: /api/animation streams one JSON frame per line. The first frame
+// is a keyframe, later frames only carry the station changes since the frame
+// before, plus all of their contour lines.
+function decodeLine(line) {
+  var coords = [];
+  var x = 0;
+  var y = 0;
+  for (var i = 1; i < line.length; i += 2) {
+    x += line[i];
+    y += line[i + 1];
+    coords.push([x / 1000, y / 1000]);
+  }
+  return coords;
+}
+
+function frameToGeoJSON(lines) {
+  return {
+    type: "FeatureCollection",
+    features: lines.map((line) => {
+      var coords = decodeLine(line);
+      return {
+        type: "Feature",
+        geometry: { type: "LineString", coordinates: coords },
+        properties: {
+          level: line[0],
+          label: line[0],
+          label_coords: coords[Math.floor(coords.length / 2)],
+        },
+      };
+    }),
+  };
+}
+
+function applyFrame(state, frame) {
+  if (frame.key) {
+    state.lines = frame.lines;
+    state.stations = {};
+    frame.stations.code.forEach((code, i) => {
+      state.stations[code] = {
+        code: code,
+        lat: frame.stations.lat[i],
+        lon: frame.stations.lon[i],
+        temp: frame.stations.temp[i],
+        station: frame.stations.station[i],
+      };
+    });
+    return state;
+  }
+  state.lines = frame.lines;
+  frame.stations.del.forEach((code) => delete state.stations[code]);
+  frame.stations.set.forEach(([code, temp]) => (state.stations[code].temp = temp));
+  frame.stations.add.code.forEach((code, i) => {
+    state.stations[code] = {
+      code: code,
+      lat: frame.stations.add.lat[i],
+      lon: frame.stations.add.lon[i],
+      temp: frame.stations.add.temp[i],
+      station: frame.stations.add.station[i],
+    };
+  });
+  return state;
+}
+
+async function playAnimation(start, end, frameDelay = 1000) {
+  const response = await fetch(`/api/animation?start=${start}&end=${end}`);
+  const reader = response.body.getReader();
+  const decoder = new TextDecoder();
+  var buffer = "";
+  var state = { lines: [], stations: {} };
+  while (true) {
+    const { done, value } = await reader.read();
+    if (done) break;
+    buffer += decoder.decode(value, { stream: true });
+    var newline;
+    while ((newline = buffer.indexOf("\n")) >= 0) {
+      const frame = JSON.parse(buffer.slice(0, newline));
+      buffer = buffer.slice(newline + 1);
+      state = applyFrame(state, frame);
+      currentTimestamp = frame.timestamp;
+      updateCurrentTimestamp();
+      updateTemperatureMarkers(Object.values(state.stations), frame.timestamp);
+      updateGeoJSONLayer(frameToGeoJSON(state.lines));
+      await new Promise((resolve) => setTimeout(resolve, frameDelay));
+    }
+  }
+}
+
+// Play every cycle of the selected day
+var playButton = document.getElementById("play-day");
+playButton.addEventListener("click", async function () {
+  var day = timestampSelector.value.replace(/-/g, "");
+  playButton.disabled = true;
+  // Frames carry no wind, so don't leave the selected cycle's on the map
+  windLayer.clearLayers();
+  try {
+    await playAnimation(day + "00", day + "21");
+  } finally {
+    playButton.disabled = false;
+  }
 });
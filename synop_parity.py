@@ -0,0 +1,82 @@
+"""Parity check of the fast SYNOP parser against pymetdecoder.
+
+Decodes every station line of every bulletin in Synop/ with both
+python.fast_synop.decode_lines and the pymetdecoder path used for
+fallbacks, and compares the resulting CSV fields.
+
+    python synop_parity.py              # exit 1 on any mismatch
+    python synop_parity.py --show 20    # print up to 20 mismatching lines
+"""
+import argparse,contextlib,glob,logging,math,os,sys,time
+
+SYNOP_DIR = 'Synop'
+
+
+def same(a, b):
+    if isinstance(a, float) and isinstance(b, float) and math.isnan(a) and math.isnan(b):
+        return True
+    return a == b and type(a) == type(b)
+
+def check_file(path, decoding, fast_synop):
+    """(lines, fallbacks, mismatches, fast seconds, pymetdecoder seconds) for one bulletin file."""
+    filename = os.path.basename(path)
+    time_str = filename.split('.')[0][6:10] + decoding.DEFAULT_WIND_INDICATOR
+    with open(path, 'r') as f:
+        lines = [line.strip() for line in f if line.strip()]
+    lines = list(dict.fromkeys(line for line in lines if line.split()[0].isdigit() and len(line.split()[0]) == 5))
+
+    start = time.perf_counter()
+    columns, fallback = fast_synop.decode_lines(lines, time_str)
+    fast_seconds = time.perf_counter() - start
+
+    fallback = set(fallback)
+    mismatches = []
+    start = time.perf_counter()
+    for position, line in enumerate(lines):
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            decoded_synop = decoding.decode_synop_data(f"{decoding.STATION_TYPE} {time_str} {line}")
+        expected = decoding.decoded_fields(decoded_synop, time_str)
+        if position in fallback:
+            continue
+        diff = {field: (columns[field][position], value) for field, value in expected.items()
+                if not same(columns[field][position], value)}
+        if diff:
+            mismatches.append((line, diff))
+    slow_seconds = time.perf_counter() - start
+    return len(lines), len(fallback), mismatches, fast_seconds, slow_seconds
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--directory', default=SYNOP_DIR)
+    parser.add_argument('--show', type=int, default=5, help='mismatching lines to print')
+    args = parser.parse_args()
+
+    # Parity runs must not add to the service's metrics
+    from python import metrics
+    metrics.disable()
+    from python import decoding, fast_synop
+    # python.decoding points stdout/stderr at /dev/null on import
+    sys.stdout = sys.__stdout__
+    sys.stderr = sys.__stderr__
+    logging.getLogger().setLevel(logging.ERROR)
+
+    totals = [0, 0, 0, 0.0, 0.0]
+    shown = 0
+    for path in sorted(glob.glob(os.path.join(args.directory, '*syn.txt'))):
+        lines, fallbacks, mismatches, fast_seconds, slow_seconds = check_file(path, decoding, fast_synop)
+        print(f"{os.path.basename(path)}: {lines} lines, {fallbacks} fallbacks, {len(mismatches)} mismatches")
+        for line, diff in mismatches[:max(args.show - shown, 0)]:
+            print(f"  {line}")
+            for field, (fast, expected) in diff.items():
+                print(f"    {field}: fast={fast!r} pymetdecoder={expected!r}")
+        shown += len(mismatches)
+        for i, value in enumerate((lines, fallbacks, len(mismatches), fast_seconds, slow_seconds)):
+            totals[i] += value
+
+    lines, fallbacks, mismatches, fast_seconds, slow_seconds = totals
+    print(f"Total: {lines} lines, {fallbacks} fallbacks ({fallbacks / max(lines, 1):.1%}), {mismatches} mismatches")
+    print(f"Fast parser {fast_seconds:.2f}s, pymetdecoder {slow_seconds:.2f}s")
+    sys.exit(1 if mismatches else 0)
+
+if __name__ == '__main__':
+    main()